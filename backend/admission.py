@@ -0,0 +1,182 @@
+import math
+import time
+import asyncio
+import contextlib
+from collections import deque
+from typing import Callable
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is turned away. `status` is the HTTP status to answer with and
+    `retry_after` how many seconds the client should wait before retrying.
+    """
+
+    def __init__(self, message: str, retry_after: float, status: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class AdmissionController:
+    """
+    Bounds the number of prompts being worked on at once.
+
+    Up to `max_active` prompts run at a time and up to `max_queued` more wait for a slot in
+    FIFO order. When the queue is full, or a prompt has waited `queue_timeout` seconds,
+    the request fails fast with Overloaded instead of piling up. Its Retry-After is the
+    expected time for the queue to drain, from an EWMA of how long prompts take.
+    """
+
+    Alpha = 0.2
+
+    def __init__(
+        self,
+        max_active: int = 32,
+        max_queued: int = 64,
+        queue_timeout: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._duration: float | None = None
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        await self._acquire()
+
+        start = self.clock()
+
+        try:
+            yield
+
+        finally:
+            duration = self.clock() - start
+            self._duration = (
+                duration
+                if self._duration is None
+                else self.Alpha * duration + (1 - self.Alpha) * self._duration
+            )
+            self._release()
+
+    def retry_after(self) -> int:
+        if self._duration is None:
+            return 1
+
+        return max(1, math.ceil(self._duration * (len(self._waiters) + 1) / self.max_active))
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_duration": round(self._duration, 3) if self._duration is not None else None,
+        }
+
+    async def _acquire(self):
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded("Server is busy, try again later", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended, so pass it on.
+                self._release()
+
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Overloaded("Server is busy, try again later", self.retry_after()) from None
+
+            raise
+
+        self.admitted += 1
+
+    def _release(self):
+        # A freed slot goes straight to the oldest waiter, so `active` stays the same.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.active -= 1
+
+
+class SessionLocks:
+    """
+    Orders the turns of each chat: one turn runs at a time and the others wait in FIFO
+    order. A chat with `max_pending` turns already waiting rejects further ones with a 429.
+    Locks are dropped once no turn holds or waits for them.
+    """
+
+    def __init__(self, max_pending: int = 4):
+        self.max_pending = max_pending
+
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+        self.waited = 0
+        self.rejected = 0
+
+    @contextlib.asynccontextmanager
+    async def hold(self, chat_id: str):
+        lock, users = self._locks.get(chat_id, (None, 0))
+
+        if lock is None:
+            lock = asyncio.Lock()
+
+        if users > self.max_pending:
+            self.rejected += 1
+            raise Overloaded(
+                f"Too many pending prompts for chat {chat_id}", retry_after=1, status=429
+            )
+
+        if users:
+            self.waited += 1
+
+        self._locks[chat_id] = (lock, users + 1)
+
+        try:
+            async with lock:
+                yield
+
+        finally:
+            lock, users = self._locks[chat_id]
+
+            if users == 1:
+                del self._locks[chat_id]
+            else:
+                self._locks[chat_id] = (lock, users - 1)
+
+    def stats(self) -> dict:
+        return {"locked": len(self._locks), "waited": self.waited, "rejected": self.rejected}
@@ -1,14 +1,35 @@
 from fastapi import FastAPI, Body
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from pydantic import BaseModel
-from ytchat import YTChat
+from ytchat import YTChat, SharedPlanCache
+from sessions import SessionStore
+from journal import open_journal, VersionConflict
+from admission import AdmissionController, SessionLocks, Overloaded
+from yt import response_cache, quota_ledger
+from metrics import render
+from contexts.router_context import ProvidersStats
 from dotenv import load_dotenv
 import os
 import json
 import uuid
+import logging
+import contextlib
 
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
+# httpx logs every request it sends at INFO, which is one line per YouTube and LLM call.
+for name in ("httpx", "httpcore"):
+    logging.getLogger(name).setLevel(logging.WARNING)
+
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 # Add CORS middleware
@@ -20,26 +41,193 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-chats = {}
+def on_evict(chat_id: str, yt_chat: YTChat, reason: str):
+    logger.info("Evicting chat %s (%s)", chat_id, reason)
+
+chats = SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX", 1000)),
+    idle_ttl=float(os.getenv("SESSION_TTL", 1800)),
+    max_tokens=int(os.getenv("SESSION_MAX_TOKENS", 24000)),
+    on_evict=on_evict,
+)
+
+# Where chats are persisted: "memory" (default), "sqlite:///path" or "redis://host:port/db".
+# SESSION_DB=path is kept as a shorthand for an SQLite file.
+journal = open_journal(
+    os.getenv("SESSION_BACKEND")
+    or (f"sqlite:///{os.environ['SESSION_DB']}" if os.getenv("SESSION_DB") else None),
+    retention=float(os.getenv("SESSION_RETENTION", 7 * 86400)),
+)
+
+# Turns on one chat run one at a time, and at most MAX_ACTIVE_PROMPTS prompts run at once
+# with MAX_QUEUED_PROMPTS more waiting. Anything beyond that is turned away with a 503.
+session_locks = SessionLocks(max_pending=int(os.getenv("SESSION_QUEUE_MAX", 4)))
+
+admission = AdmissionController(
+    max_active=int(os.getenv("MAX_ACTIVE_PROMPTS", 32)),
+    max_queued=int(os.getenv("MAX_QUEUED_PROMPTS", 64)),
+    queue_timeout=float(os.getenv("PROMPT_QUEUE_TIMEOUT", 10)),
+)
 
 class PromptInput(BaseModel):
     input: str
     chat_id: str = None
 
+async def get_chat(prompt_input: PromptInput) -> YTChat:
+    """
+    Returns the chat for prompt_input.chat_id, creating one if it doesn't exist. A chat held
+    in memory is reloaded from the journal if another worker has saved it since.
+    Must be called while holding the chat's session lock.
+    """
+    yt_chat = chats.get(prompt_input.chat_id)
+
+    if yt_chat is not None and await journal.version(prompt_input.chat_id) == yt_chat.Version:
+        return yt_chat
+
+    loaded = await journal.load(prompt_input.chat_id)
+
+    yt_chat = YTChat(os.getenv("GROQ_KEY"), os.getenv("YT_KEY"))
+
+    if loaded is not None:
+        messages, yt_chat.Version = loaded
+        yt_chat.Restore(messages)
+    else:
+        yt_chat.Setup()
+
+    chats.put(prompt_input.chat_id, yt_chat)
+
+    return yt_chat
+
+async def end_turn(chat_id: str, yt_chat: YTChat, version: int):
+    """
+    Trims the chat to its budget and journals the turn on top of the version it started
+    from. On a conflict the chat is dropped from memory, so the next request reloads it.
+    """
+    chats.enforce_budget(chat_id)
+
+    try:
+        yt_chat.Version = await journal.save(chat_id, yt_chat.Contexts(), version)
+
+    except VersionConflict:
+        chats.evict(chat_id)
+        raise
+
+async def start_turn(prompt_input: PromptInput, stack: contextlib.AsyncExitStack) -> YTChat:
+    """
+    Waits for the chat's previous turns and for an admission slot, both held until the
+    stack is closed, and returns the chat.
+    """
+    if prompt_input.chat_id is None:
+        prompt_input.chat_id = str(uuid.uuid4())
+
+    await stack.enter_async_context(session_locks.hold(prompt_input.chat_id))
+    await stack.enter_async_context(admission.admit())
+
+    return await get_chat(prompt_input)
+
+@app.exception_handler(Overloaded)
+async def overloaded(request, e: Overloaded):
+    return JSONResponse(
+        {"detail": str(e)}, status_code=e.status, headers={"Retry-After": str(e.retry_after)}
+    )
+
+@app.exception_handler(VersionConflict)
+async def version_conflict(request, e: VersionConflict):
+    return JSONResponse({"detail": str(e), "chat_id": e.chat_id}, status_code=409)
+
 @app.post("/prompt")
 async def prompt(prompt_input: PromptInput):
-    if prompt_input.chat_id not in chats:
-        if prompt_input.chat_id is None:
-            prompt_input.chat_id = str(uuid.uuid4())
+    async with contextlib.AsyncExitStack() as stack:
+        yt_chat = await start_turn(prompt_input, stack)
+        version = yt_chat.Version
+        response = await yt_chat.Prompt(prompt_input.input)
+        await end_turn(prompt_input.chat_id, yt_chat, version)
+
+    logger.debug("Response: %s", response)
+    return {"response": json.loads(response), "chat_id": prompt_input.chat_id}
 
-        chats[prompt_input.chat_id] = YTChat(os.getenv("GROQ_KEY"), os.getenv("YT_KEY"))
-        chats[prompt_input.chat_id].Setup()
+@app.get("/sessions/stats")
+async def session_stats():
+    return chats.stats()
 
-    yt_chat = chats[prompt_input.chat_id]
-    response = yt_chat.Prompt(prompt_input.input)
+@app.get("/admission/stats")
+async def admission_stats():
+    return {**admission.stats(), "sessions": session_locks.stats()}
 
-    print("Response:", response)
-    return {"response": json.loads(response), "chat_id": prompt_input.chat_id}
+@app.get("/sessions/journal/stats")
+async def journal_stats():
+    return journal.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache().stats()
+
+@app.get("/plans/stats")
+async def plan_stats():
+    plans = SharedPlanCache()
+    return plans.stats() if plans is not None else {"enabled": False}
+
+@app.get("/llm/providers/stats")
+async def providers_stats():
+    return ProvidersStats()
+
+@app.get("/quota/stats")
+async def quota_stats():
+    return quota_ledger(os.getenv("YT_KEY")).stats()
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render()
+    return Response(body, media_type=content_type)
+
+def sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+@app.post("/prompt/stream")
+async def prompt_stream(prompt_input: PromptInput):
+    # The turn is admitted before the response starts, so a rejection is a plain 429/503.
+    stack = contextlib.AsyncExitStack()
+
+    try:
+        yt_chat = await start_turn(prompt_input, stack)
+
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    version = yt_chat.Version
+
+    async def events():
+        yield sse({"event": "chat", "chat_id": prompt_input.chat_id})
+
+        try:
+            async for event in yt_chat.PromptStream(prompt_input.input):
+                if event["event"] == "done":
+                    await end_turn(prompt_input.chat_id, yt_chat, version)
+                    event["response"] = json.loads(event["response"])
+
+                yield sse(event)
+
+        except VersionConflict as e:
+            yield sse({"event": "error", "message": str(e), "status": 409})
+
+        except Exception as e:
+            logger.exception("Prompt failed")
+            yield sse({"event": "error", "message": str(e)})
+
+        finally:
+            await stack.aclose()
+
+    # The background task releases the turn if the stream never started.
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(stack.aclose),
+    )
 
 # Example curl command:
 # curl -X POST "http://localhost:8000/prompt" -H "Content-Type: application/json" -d '{"input": "Search for videos about cats"}'
+
+# Streaming variant, one `data: {...}` Server-Sent Event per stage, formatter token and the final response:
+# curl -N -X POST "http://localhost:8000/prompt/stream" -H "Content-Type: application/json" -d '{"input": "Search for videos about cats"}'
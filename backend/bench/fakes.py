@@ -0,0 +1,238 @@
+import os
+import re
+import json
+import time
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+
+# Stand-ins for the Groq chat completions API and the YouTube Data API, so the backend can be
+# load tested without spending real tokens or quota. Both are served by the same app.
+#
+# BENCH_LLM_LATENCY: seconds before the first token of a completion (default 0.2).
+# BENCH_TOKEN_RATE: tokens streamed per second after that (default 250).
+# BENCH_YT_LATENCY: seconds each YouTube request takes (default 0.05).
+
+LLM_LATENCY = float(os.getenv("BENCH_LLM_LATENCY", 0.2))
+TOKEN_RATE = float(os.getenv("BENCH_TOKEN_RATE", 250))
+YT_LATENCY = float(os.getenv("BENCH_YT_LATENCY", 0.05))
+
+# Fake tokens are ~4 characters, like the estimate the backend uses.
+TOKEN_CHARS = 4
+
+app = FastAPI()
+
+counters = {"completions": 0, "youtube": 0}
+
+
+def agent_calls(question: str) -> list[dict]:
+    """
+    The YTAgent's plan for a question: a search for whatever the question is about, plus
+    the channel of the top result.
+    """
+    match = re.search(r"about (.+)", question)
+    query = match.group(1).strip(" ?.!") if match else question
+
+    return [
+        {"function": "search_videos", "params": {"query": query, "max_results": 5}},
+        {"function": "get_channel_info", "params": {"channel_id": f"UC{query}"}},
+    ]
+
+
+def reply_for(messages: list[dict], tools: bool) -> tuple[str, list[dict]]:
+    """
+    Returns the content and tool calls of the reply. With tools, the agent's plan comes
+    back as native tool calls, otherwise as JSON lines.
+    """
+    system = " ".join(message["content"] for message in messages if message["role"] == "system")
+    question = messages[-1]["content"] if messages else ""
+
+    if "You write the remarks" in system:
+        return "Here are the videos I found. " * 20, []
+
+    if "JSON formatter" in system:
+        return json.dumps({"response": {"success": True, "data": {}}, "remarks": "Here you go."}), []
+
+    calls = agent_calls(question)
+
+    if tools:
+        return "", [
+            {
+                "index": i,
+                "id": f"call_{i}",
+                "type": "function",
+                "function": {"name": call["function"], "arguments": json.dumps(call["params"])},
+            }
+            for i, call in enumerate(calls)
+        ]
+
+    return "\n".join(json.dumps(call) for call in calls), []
+
+
+def completion(body: dict, **fields) -> dict:
+    return {
+        "id": "bench",
+        "object": "chat.completion.chunk" if body.get("stream") else "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        **fields,
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["completions"] += 1
+
+    content, toolCalls = reply_for(body["messages"], bool(body.get("tools")))
+    promptLength = sum(len(message["content"]) for message in body["messages"])
+    promptLength += len(json.dumps(body.get("tools", [])))
+    completionLength = len(content) + sum(
+        len(call["function"]["arguments"]) for call in toolCalls
+    )
+    usage = {
+        "prompt_tokens": promptLength // TOKEN_CHARS,
+        "completion_tokens": completionLength // TOKEN_CHARS,
+        "total_tokens": (promptLength + completionLength) // TOKEN_CHARS,
+    }
+
+    await asyncio.sleep(LLM_LATENCY)
+
+    if not body.get("stream"):
+        return completion(
+            body,
+            choices=[
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": content or None,
+                        **({"tool_calls": toolCalls} if toolCalls else {}),
+                    },
+                    "finish_reason": "tool_calls" if toolCalls else "stop",
+                }
+            ],
+            usage=usage,
+        )
+
+    def deltas():
+        for i in range(0, len(content), TOKEN_CHARS):
+            yield {"content": content[i : i + TOKEN_CHARS]}
+
+        # Like OpenAI, the name comes first and the arguments follow in fragments.
+        for call in toolCalls:
+            arguments = call["function"]["arguments"]
+
+            yield {"tool_calls": [{**call, "function": {"name": call["function"]["name"], "arguments": ""}}]}
+
+            for i in range(0, len(arguments), TOKEN_CHARS):
+                yield {
+                    "tool_calls": [
+                        {"index": call["index"], "function": {"arguments": arguments[i : i + TOKEN_CHARS]}}
+                    ]
+                }
+
+    async def chunks():
+        for delta in deltas():
+            chunk = completion(
+                body, choices=[{"index": 0, "delta": delta, "finish_reason": None}]
+            )
+
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(1 / TOKEN_RATE)
+
+        chunk = completion(
+            body,
+            choices=[
+                {"index": 0, "delta": {}, "finish_reason": "tool_calls" if toolCalls else "stop"}
+            ],
+            x_groq={"id": "bench", "usage": usage},
+        )
+
+        yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+@app.get("/openai/v1/models")
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "bench", "object": "model", "created": 0, "owned_by": "bench"}]}
+
+
+SNIPPET = {
+    "title": "Benchmark video",
+    "description": "A video served by the benchmark's fake YouTube API. " * 4,
+    "channelTitle": "Benchmark channel",
+    "publishedAt": "2024-01-01T00:00:00Z",
+    "thumbnails": {"default": {"url": "https://i.ytimg.com/vi/bench/default.jpg"}},
+}
+
+STATISTICS = {"viewCount": "1000", "likeCount": "100", "commentCount": "10"}
+
+
+def youtube_items(resource: str, params: dict) -> list[dict]:
+    ids = params.get("id", "").split(",") if params.get("id") else []
+    count = int(params.get("maxResults", 5))
+
+    if resource == "search":
+        return [
+            {"id": {"videoId": f"video{i}", "channelId": f"channel{i}"}, "snippet": SNIPPET}
+            for i in range(count)
+        ]
+
+    if resource == "videos":
+        return [
+            {
+                "id": id,
+                "snippet": SNIPPET,
+                "statistics": STATISTICS,
+                "contentDetails": {"duration": "PT4M13S"},
+            }
+            for id in ids
+        ]
+
+    if resource == "channels":
+        return [
+            {
+                "id": id,
+                "snippet": SNIPPET,
+                "statistics": {"subscriberCount": "5000", "viewCount": "100000", "videoCount": "50"},
+            }
+            for id in ids or ["channel"]
+        ]
+
+    if resource == "playlistItems":
+        return [
+            {"snippet": {**SNIPPET, "resourceId": {"videoId": f"video{i}"}}} for i in range(count)
+        ]
+
+    if resource == "commentThreads":
+        comment = {
+            "authorDisplayName": "viewer",
+            "textDisplay": "Great video",
+            "likeCount": 1,
+            "publishedAt": "2024-01-01T00:00:00Z",
+        }
+        return [{"snippet": {"topLevelComment": {"snippet": comment}}} for _ in range(count)]
+
+    if resource == "videoCategories":
+        return [{"id": "1", "snippet": {"title": "Film & Animation"}}]
+
+    return []
+
+
+@app.get("/youtube/v3/{resource}")
+async def youtube(resource: str, request: Request):
+    counters["youtube"] += 1
+
+    await asyncio.sleep(YT_LATENCY)
+
+    return JSONResponse({"items": youtube_items(resource, dict(request.query_params))})
+
+
+@app.get("/stats")
+async def stats():
+    return counters
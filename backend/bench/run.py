@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import httpx
+
+# Load test for the backend. Starts the fake Groq and YouTube APIs from bench/fakes.py and
+# the API server pointed at them, drives /prompt at a fixed concurrency and writes latency
+# percentiles, throughput and memory use to a JSON file.
+#
+# Run from the backend directory:
+#   python -m bench.run --concurrency 16 --requests 400 --out bench-results.json
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = [
+    "cats", "dogs", "sourdough baking", "rust programming", "chess openings",
+    "home workouts", "jazz piano", "street food", "woodworking", "astronomy",
+    "climbing", "origami", "guitar lessons", "gardening", "speedrunning", "chemistry",
+]
+
+# Environment for the API server. The quota ledger is effectively disabled, since a
+# benchmark makes far more search calls than a real key's daily quota allows.
+SERVER_ENV = {
+    "GROQ_KEY": "bench",
+    "YT_KEY": "bench",
+    "YT_DAILY_QUOTA": str(10**12),
+    "YT_QUOTA_BURST": str(10**12),
+    "YT_QUOTA_RESERVE": "0",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND,
+        env={**os.environ, **env},
+    )
+
+
+async def wait_until_up(client: httpx.AsyncClient, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            await client.get(url)
+            return
+
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def rss_bytes(pid: int) -> int | None:
+    """
+    Resident memory of a process, read from /proc. Returns None where that isn't available.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+
+    except OSError:
+        return None
+
+    return None
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+
+    return values[index]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def drive(client: httpx.AsyncClient, base: str, args) -> dict:
+    """
+    Sends args.requests prompts from args.concurrency workers. Each worker keeps a chat for
+    args.turns prompts before starting a new one.
+    """
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    counter = iter(range(args.requests))
+
+    async def worker():
+        chatId = None
+        turns = 0
+
+        for i in counter:
+            if turns >= args.turns:
+                chatId, turns = None, 0
+
+            topic = TOPICS[i % len(TOPICS)]
+            body = {"input": f"Search for videos about {topic} {i}"}
+
+            if chatId is not None:
+                body["chat_id"] = chatId
+
+            start = time.perf_counter()
+
+            try:
+                response = await client.post(f"{base}/prompt", json=body, timeout=args.timeout)
+                response.raise_for_status()
+
+                chatId = response.json()["chat_id"]
+                turns += 1
+                latencies.append(time.perf_counter() - start)
+
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                chatId, turns = None, 0
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "completed": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_s": {
+            "mean": round(statistics.fmean(latencies), 4) if latencies else None,
+            **{
+                f"p{p}": round(value, 4) if (value := percentile(latencies, p)) is not None else None
+                for p in (50, 95, 99)
+            },
+            "max": round(max(latencies), 4) if latencies else None,
+        },
+    }
+
+
+async def main(args):
+    fakesPort, apiPort = free_port(), free_port()
+    fakesBase = f"http://127.0.0.1:{fakesPort}"
+    apiBase = f"http://127.0.0.1:{apiPort}"
+
+    fakes = start_server(
+        "bench.fakes:app",
+        fakesPort,
+        {
+            "BENCH_LLM_LATENCY": str(args.llm_latency),
+            "BENCH_TOKEN_RATE": str(args.token_rate),
+            "BENCH_YT_LATENCY": str(args.yt_latency),
+        },
+    )
+
+    serverEnv = {**SERVER_ENV, "GROQ_BASE_URL": fakesBase, "YT_API_BASE": fakesBase}
+    serverEnv.update(dict(pair.split("=", 1) for pair in args.env))
+
+    server = start_server("api:app", apiPort, serverEnv)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    try:
+        async with httpx.AsyncClient(limits=limits) as client:
+            await wait_until_up(client, f"{fakesBase}/stats")
+            await wait_until_up(client, f"{apiBase}/sessions/stats")
+
+            rssBefore = rss_bytes(server.pid)
+            results = await drive(client, apiBase, args)
+            rssAfter = rss_bytes(server.pid)
+
+            sessions = (await client.get(f"{apiBase}/sessions/stats")).json()
+            upstream = (await client.get(f"{fakesBase}/stats")).json()
+
+    finally:
+        for process in (server, fakes):
+            process.terminate()
+            process.wait(timeout=10)
+
+    liveSessions = sessions.get("sessions", 0)
+
+    results["memory"] = {
+        "rss_before_bytes": rssBefore,
+        "rss_after_bytes": rssAfter,
+        "sessions": liveSessions,
+        "bytes_per_session": (
+            (rssAfter - rssBefore) // liveSessions
+            if rssBefore is not None and rssAfter is not None and liveSessions
+            else None
+        ),
+    }
+    results["upstream"] = upstream
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "turns": args.turns,
+            "llm_latency_s": args.llm_latency,
+            "token_rate": args.token_rate,
+            "yt_latency_s": args.yt_latency,
+            "env": args.env,
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /prompt against local fakes.")
+
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients.")
+    parser.add_argument("--requests", type=int, default=200, help="Total prompts to send.")
+    parser.add_argument("--turns", type=int, default=1, help="Prompts per chat session.")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds.")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake LLM time to first token.")
+    parser.add_argument("--token-rate", type=float, default=250, help="Fake LLM tokens per second.")
+    parser.add_argument("--yt-latency", type=float, default=0.05, help="Fake YouTube API latency.")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="KEY=VALUE",
+        help="Extra environment for the API server, e.g. --env PLAN_CACHE_SIZE=0.",
+    )
+    parser.add_argument("--out", default="bench-results.json", help="Where to write the results.")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+
+    with open(args.out, "w") as fp:
+        json.dump(report, fp, indent=2)
+
+    print(json.dumps(report["results"], indent=2))
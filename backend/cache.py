@@ -0,0 +1,199 @@
+import json
+import time
+import pickle
+import sqlite3
+import asyncio
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+def make_key(name: str, params: dict) -> str:
+    """
+    Builds a cache key from a method name and its bound parameters. Strings are stripped,
+    numeric strings become ints and free-text queries are case-folded, so that equivalent
+    calls produced by the LLM share an entry.
+    """
+    normalized = {}
+
+    for key, value in params.items():
+        if isinstance(value, str):
+            value = value.strip()
+
+            if value.isdigit():
+                value = int(value)
+
+            elif key == "query":
+                value = value.casefold()
+
+        normalized[key] = value
+
+    return f"{name}:{json.dumps(normalized, sort_keys=True, default=str)}"
+
+
+class ResponseCache:
+    """
+    Bounded in-memory LRU cache with per-entry TTLs, an optional SQLite tier that survives
+    restarts, and in-flight deduplication: concurrent lookups of the same missing key share
+    a single fetch.
+
+    Expired entries stay in memory until they are evicted. When a fetch fails with one of
+    `serve_stale_on`, the expired value is returned instead of the error.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        db_path: str | None = None,
+        clock: Callable[[], float] = time.time,
+        serve_stale_on: tuple[type[Exception], ...] = (),
+    ):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.serve_stale_on = serve_stale_on
+
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+        self._db = None
+        self._dbLock = threading.Lock()
+
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL, value BLOB)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (clock(),))
+            self._db.commit()
+
+    async def get_or_fetch(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]):
+        """
+        Returns the cached value for key, or awaits fetch() and caches its result for ttl seconds.
+        Failed fetches are not cached.
+        """
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[0] > self.clock():
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        task = self._inflight.get(key)
+
+        if task is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.create_task(self._load(key, ttl, fetch))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self._entries.clear()
+
+        if self._db is not None:
+            with self._dbLock:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "deduplicated": self.deduplicated,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+        }
+
+    async def _load(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]):
+        if self._db is not None:
+            row = await asyncio.to_thread(self._read, key)
+
+            if row is not None:
+                self.disk_hits += 1
+                self._store(key, row[0], pickle.loads(row[1]))
+                return self._entries[key][1]
+
+        self.misses += 1
+
+        try:
+            value = await fetch()
+
+        except self.serve_stale_on:
+            if key not in self._entries:
+                raise
+
+            self.stale_hits += 1
+            return self._entries[key][1]
+
+        expires_at = self.clock() + ttl
+
+        self._store(key, expires_at, value)
+
+        if self._db is not None:
+            await asyncio.to_thread(self._write, key, expires_at, pickle.dumps(value))
+
+        return value
+
+    def _store(self, key: str, expires_at: float, value: Any):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _read(self, key: str):
+        with self._dbLock:
+            return self._db.execute(
+                "SELECT expires_at, value FROM responses WHERE key = ? AND expires_at > ?",
+                (key, self.clock()),
+            ).fetchone()
+
+    def _write(self, key: str, expires_at: float, value: bytes):
+        with self._dbLock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, value),
+            )
+            self._db.commit()
+
+
+def cached(ttl: float):
+    """
+    Caches an async method's result in `self.cache`, keyed on the method name and its
+    normalized arguments (defaults included).
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+
+            params = {key: value for key, value in bound.arguments.items() if key != "self"}
+
+            return await self.cache.get_or_fetch(
+                make_key(func.__name__, params), ttl, lambda: func(self, *args, **kwargs)
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class BatchCoalescer:
+    """
+    Merges id lookups from concurrent callers into batched requests.
+
+    Ids requested within `window` seconds of each other are collected and fetched
+    `max_batch` at a time through `fetch(ids) -> {id: item}`; as soon as a full batch is
+    queued it is sent without waiting for the window. Each caller gets back only the items
+    for its own ids. Ids that are already queued or in flight are shared, not re-requested.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[list[str]], Awaitable[dict[str, Any]]],
+        max_batch: int = 50,
+        window: float = 0.005,
+    ):
+        self.fetch = fetch
+        self.max_batch = max_batch
+        self.window = window
+
+        self._pending: dict[str, asyncio.Future] = {}
+        self._queued: list[str] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # The event loop only keeps weak references to tasks.
+        self._tasks: set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.requested_ids = 0
+
+    async def load(self, ids: list[str]) -> dict[str, Any]:
+        """
+        Returns {id: item} for the ids that exist; missing ids are left out.
+        """
+        loop = asyncio.get_running_loop()
+        futures: dict[str, asyncio.Future] = {}
+
+        for id in ids:
+            if id not in self._pending:
+                self._pending[id] = loop.create_future()
+                self._queued.append(id)
+
+            futures[id] = self._pending[id]
+
+        self.requested_ids += len(futures)
+
+        if len(self._queued) >= self.max_batch:
+            self._flush(fullOnly=True)
+
+        if self._queued and self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        # Futures are shared with other callers, so a cancelled caller must not cancel them.
+        items = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+
+        return {id: item for id, item in zip(futures, items) if item is not None}
+
+    def _flush(self, fullOnly: bool = False):
+        if self._timer is not None and not fullOnly:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queued and (not fullOnly or len(self._queued) >= self.max_batch):
+            ids = self._queued[: self.max_batch]
+            self._queued = self._queued[self.max_batch :]
+
+            task = asyncio.create_task(self._dispatch(ids))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        if not self._queued and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _dispatch(self, ids: list[str]):
+        self.batches += 1
+
+        try:
+            try:
+                items = await self.fetch(ids)
+
+            except Exception as e:
+                for id in ids:
+                    future = self._pending.pop(id)
+
+                    if not future.done():
+                        future.set_exception(e)
+
+                return
+
+            for id in ids:
+                future = self._pending.pop(id)
+
+                if not future.done():
+                    future.set_result(items.get(id))
+
+        finally:
+            # Reached with futures unresolved when the dispatch is cancelled, e.g. at shutdown.
+            for id in ids:
+                future = self._pending.pop(id, None)
+
+                if future is not None and not future.done():
+                    future.cancel()
@@ -0,0 +1,108 @@
+import os
+import logging
+from typing import Any
+
+from records import Record, dumps
+from metrics import LLM_RESULT_TOKENS
+from contexts.history import EstimateTokens
+
+logger = logging.getLogger(__name__)
+
+# Encoding of tool results for the LLMs. Clients get the full data, but the agent and the
+# formatter only need enough of it to answer, so LLM-bound results are shrunk:
+#
+# - fields the client can rebuild from an id (videoUrl, channelUrl) or that the LLM has no
+#   use for (thumbnailUrl) are dropped,
+# - long free text (descriptions and comment text) is cut to LLM_TEXT_CHARS characters,
+# - lists of flat objects are laid out as a table, {"columns": [...], "rows": [[...], ...]},
+#   so keys are sent once instead of once per item.
+#
+# LLM_RESULT_FORMAT=json sends the full JSON instead.
+
+DROPPED = {"videoUrl", "channelUrl", "thumbnailUrl"}
+TRUNCATED = {"description", "text"}
+
+LLM_RESULT_FORMAT = os.getenv("LLM_RESULT_FORMAT", "compact")
+LLM_TEXT_CHARS = int(os.getenv("LLM_TEXT_CHARS", 200))
+
+
+def truncate(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+
+    return text if len(text) <= limit else text[: limit - 1].rstrip() + "…"
+
+
+def flat(value: Any) -> bool:
+    return isinstance(value, dict) and not any(
+        isinstance(item, (dict, list)) for item in value.values()
+    )
+
+
+def table(items: list[dict]) -> dict:
+    """
+    Lays out a list of objects as columns and rows. Columns are the union of the items'
+    keys in first-seen order, and keys an item lacks are null in its row.
+    """
+    columns = list(dict.fromkeys(key for item in items for key in item))
+
+    return {"columns": columns, "rows": [[item.get(key) for key in columns] for item in items]}
+
+
+def shrink(value: Any, text_chars: int = LLM_TEXT_CHARS) -> Any:
+    """
+    Returns value with derivable fields dropped, long text truncated and lists of flat
+    objects turned into tables. Records are handled like dicts.
+    """
+    if isinstance(value, Record):
+        value = value.to_dict()
+
+    if isinstance(value, dict):
+        shrunk = {
+            key: (
+                truncate(item, text_chars)
+                if key in TRUNCATED and isinstance(item, str)
+                else shrink(item, text_chars)
+            )
+            for key, item in value.items()
+            if key not in DROPPED
+        }
+
+        # {id: details} mappings whose details repeat the id, as from get_video_details.
+        if len(shrunk) > 1 and all(
+            flat(item) and item.get("id") == key for key, item in shrunk.items()
+        ):
+            return table(list(shrunk.values()))
+
+        return shrunk
+
+    if isinstance(value, list):
+        items = [shrink(item, text_chars) for item in value]
+
+        if len(items) > 1 and all(flat(item) for item in items):
+            return table(items)
+
+        return items
+
+    return value
+
+
+def encode(value: Any, stage: str) -> str:
+    """
+    Encodes tool output bound for an LLM, compact unless LLM_RESULT_FORMAT is json. The
+    estimated size in tokens of the full and compact encodings is recorded for `stage` in
+    the llm_result_tokens histogram.
+    """
+    full = dumps(value)
+
+    if LLM_RESULT_FORMAT != "compact":
+        return full
+
+    encoded = dumps(shrink(value))
+    before, after = EstimateTokens(full), EstimateTokens(encoded)
+
+    LLM_RESULT_TOKENS.labels(stage=stage, encoding="json").observe(before)
+    LLM_RESULT_TOKENS.labels(stage=stage, encoding="compact").observe(after)
+
+    logger.debug("%s tool output: ~%d tokens, ~%d compacted", stage, before, after)
+
+    return encoded
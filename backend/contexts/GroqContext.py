@@ -1,7 +1,17 @@
+import os
 import json
+import logging
+import threading
 from tinytune.llmcontext import LLMContext, Model, Message
+from contexts.history import History, DropOldest
 from typing import Callable, Any, override
-from groq import Groq
+import groq
+from groq import Groq, AsyncGroq
+from contexts.async_context import AsyncChatContext
+from contexts.token_stream import TokenStream
+from contexts.ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
 
 class WebGroqMessage(Message):
     __slots__ = ("Role", "Content", "Type")
@@ -11,6 +21,34 @@ class WebGroqMessage(Message):
         self.Type = type
 
 
+def MigrateLegacyFile(promptFile: str) -> bool:
+    """
+    Rewrites a prompt file holding a single JSON array, as written by older versions, as
+    one JSON object per line, so that saves can append to it. The file is replaced
+    atomically. Returns whether it was rewritten.
+    """
+    try:
+        with open(promptFile, "r") as fp:
+            if fp.read(1) != "[":
+                return False
+
+            fp.seek(0)
+            entries = json.load(fp)
+
+    except FileNotFoundError:
+        return False
+
+    temp = f"{promptFile}.tmp"
+
+    with open(temp, "w") as fp:
+        for entry in entries:
+            fp.write(json.dumps(entry) + "\n")
+
+    os.replace(temp, promptFile)
+
+    return True
+
+
 class WebGroqContext(LLMContext[WebGroqMessage]):
     def __init__(self, model: str, apiKey: str, promptFile: str | None = None):
         super().__init__(Model("groq", model))
@@ -18,8 +56,12 @@ class WebGroqContext(LLMContext[WebGroqMessage]):
         self.APIKey: str = apiKey
         self.Messages: list[WebGroqMessage] = []
         self.QueuePointer: int = 0
+        self.History = History()
+
+        self.PersistedCount: int = 0
+        self.PendingTrim: int = 0
 
-        self.client = Groq(api_key=self.APIKey)
+        self.client = self.CreateClient()
 
         self.OnFetch = lambda content, url: (content, URL)
 
@@ -32,21 +74,71 @@ class WebGroqContext(LLMContext[WebGroqMessage]):
             )
         )
 
-    def LoadMessages(self, promptFile: str = "prompts.json") -> None:
+    def CreateClient(self):
+        return Groq(api_key=self.APIKey)
+
+    def LoadMessages(self, promptFile: str = "prompts.jsonl") -> list[WebGroqMessage]:
+        """
+        Loads the history written by `Save`, replaying its trim records. Files holding a
+        single JSON array, as written by older versions, are converted first.
+        """
+        MigrateLegacyFile(promptFile)
+
         self.PromptFile = promptFile
 
+        messages: list[WebGroqMessage] = []
+
         with open(promptFile, "r") as fp:
-            self.Messages = json.load(fp)
+            entries = (json.loads(line) for line in fp if line.strip())
+
+            for entry in entries:
+                if "trim" in entry:
+                    messages = DropOldest(messages, entry["trim"])
+                    continue
+
+                messages.append(
+                    WebGroqMessage(entry["role"], entry["content"], entry.get("type", "message"))
+                )
 
-    def Save(self, promptFile: str = "prompts.json") -> Any:
+        self.Messages = messages
+        self.PersistedCount = len(messages)
+        self.PendingTrim = 0
+
+        return messages
+
+    def Save(self, promptFile: str = "prompts.jsonl") -> Any:
+        """
+        Appends the messages added since the last save to the prompt file, one JSON object
+        per line, so a save costs O(new messages). Messages trimmed from the history are
+        recorded as a {"trim": n} line.
+        """
         try:
-            promptFile = promptFile if self.PromptFile == None else self.PromptFile
+            if self.PromptFile is None:
+                # A file that wasn't loaded may still be in the old array format.
+                MigrateLegacyFile(promptFile)
+
+                # Later saves must append to the same file.
+                self.PromptFile = promptFile
+
+            promptFile = self.PromptFile
 
-            with open(promptFile, "w") as fp:
-                json.dump([message.ToDict() for message in self.Messages], fp, indent=2)
+            with open(promptFile, "a") as fp:
+                if self.PendingTrim:
+                    fp.write(json.dumps({"trim": self.PendingTrim}) + "\n")
+
+                for message in self.Messages[self.PersistedCount :]:
+                    fp.write(
+                        json.dumps(
+                            {"role": message.Role, "content": message.Content, "type": message.Type}
+                        )
+                        + "\n"
+                    )
+
+            self.PersistedCount = len(self.Messages)
+            self.PendingTrim = 0
 
         except:
-            print("An error occurred in saving messages.")
+            logger.exception("An error occurred in saving messages.")
             return self
 
         return self
@@ -64,9 +156,9 @@ class WebGroqContext(LLMContext[WebGroqMessage]):
 
     @override
     def OnRun(self, *args, **kwargs):
-        messages = [message.ToDict() for message in self.Messages] + [
-            self.MessageQueue[self.QueuePointer].ToDict()
-        ]
+        messages = self.History.Build(
+            self.Messages, self.MessageQueue[self.QueuePointer]
+        )
 
         stream: bool | None = kwargs.get("stream")
 
@@ -86,11 +178,12 @@ class WebGroqContext(LLMContext[WebGroqMessage]):
             isSearchMessage: bool = self.Messages[-1].Type == "search_message"
 
             if stream:
+                tokens = TokenStream(self.OnGenerate)
+
                 for chunk in response:
-                    chunk_content = chunk.choices[0].delta.content
-                    if chunk_content is not None:
-                        content += chunk_content
-                        self.OnGenerate(chunk_content)
+                    tokens.Write(chunk.choices[0].delta.content)
+
+                content = tokens.Text()
             else:
                 content = response.choices[0].message.content
                 self.OnGenerate(content)
@@ -111,7 +204,48 @@ class WebGroqContext(LLMContext[WebGroqMessage]):
                 )
 
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.error("An error occurred: %s", e)
             raise e
 
         return WebGroqMessage("assistant", content)
+
+
+_clients: dict[str, AsyncGroq] = {}
+_limiters: dict[str, RateLimiter] = {}
+_clientsLock = threading.Lock()
+
+def SharedAsyncGroq(apiKey: str) -> AsyncGroq:
+    """
+    Returns the process-wide AsyncGroq client for apiKey. The client is safe to share between
+    contexts and keeps its pooled connections alive across chats. Retries are left to
+    AsyncChatContext so that they go through the shared rate limiter.
+    """
+    with _clientsLock:
+        if apiKey not in _clients:
+            _clients[apiKey] = AsyncGroq(api_key=apiKey, max_retries=0)
+
+        return _clients[apiKey]
+
+def SharedRateLimiter(apiKey: str) -> RateLimiter:
+    """
+    Returns the process-wide rate limiter for apiKey. GROQ_RPM and GROQ_TPM set the limits
+    up front; otherwise the token limit is learned from Groq's response headers.
+    """
+    with _clientsLock:
+        if apiKey not in _limiters:
+            rpm = os.getenv("GROQ_RPM")
+            tpm = os.getenv("GROQ_TPM")
+
+            _limiters[apiKey] = RateLimiter(
+                float(rpm) if rpm else None, float(tpm) if tpm else None
+            )
+
+        return _limiters[apiKey]
+
+class AsyncWebGroqContext(AsyncChatContext, WebGroqContext):
+    MessageClass = WebGroqMessage
+    RetryableErrors = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+    def CreateClient(self):
+        self.Limiter = SharedRateLimiter(self.APIKey)
+        return SharedAsyncGroq(self.APIKey)
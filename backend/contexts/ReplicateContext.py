@@ -1,7 +1,11 @@
 import json
+import logging
 from tinytune.llmcontext import LLMContext, Model, Message
 from typing import Any, override
 import replicate
+from contexts.token_stream import TokenStream
+
+logger = logging.getLogger(__name__)
 
 class ReplicateMessage(Message):
     __slots__ = ("Role", "Content", "Type")
@@ -39,7 +43,7 @@ class ReplicateContext(LLMContext[ReplicateMessage]):
                 json.dump([message.ToDict() for message in self.Messages], fp, indent=2)
 
         except:
-            print("An error occurred in saving messages.")
+            logger.exception("An error occurred in saving messages.")
             return self
         return self
 
@@ -62,16 +66,15 @@ class ReplicateContext(LLMContext[ReplicateMessage]):
                     "prompt": " ".join([str(message) for message in messages]),
                 },
             )
-            content = ""
+            tokens = TokenStream(self.OnGenerate) if stream else TokenStream()
             for event in response:
                 if event is not None:
-                    content += str(event)
-                    if stream:
-                        self.OnGenerate(event)
+                    tokens.Write(str(event))
+            content = tokens.Text()
 
             if content != "" and content:
                 self.Messages.append(ReplicateMessage("assistant", content))
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.error("An error occurred: %s", e)
             raise e
         return ReplicateMessage("assistant", content)
\ No newline at end of file
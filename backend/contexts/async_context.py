@@ -0,0 +1,283 @@
+import time
+import json
+import asyncio
+import inspect
+import logging
+from typing import Any
+
+from metrics import LLM_TIME_TO_FIRST_TOKEN_SECONDS, LLM_TOKENS
+from contexts.history import EstimateTokens
+from contexts.token_stream import TokenStream
+from contexts.ratelimit import RateLimiter, ParseDuration, RetryDelay
+
+logger = logging.getLogger(__name__)
+
+
+def Usage(response) -> Any:
+    """
+    Returns the token usage reported on a completion or stream chunk, if any. Groq reports
+    it on the last chunk of a stream under `x_groq`.
+    """
+    usage = getattr(response, "usage", None)
+
+    if usage is None:
+        usage = getattr(getattr(response, "x_groq", None), "usage", None)
+
+    return usage
+
+
+def ToolCallLine(name: str, arguments: str | None) -> str:
+    """
+    Writes a native tool call as a {"function": ..., "params": ...} line. Arguments that
+    aren't valid JSON are passed on as a string, for the call to fail on its own.
+    """
+    try:
+        params = json.loads(arguments or "{}")
+
+    except ValueError:
+        params = arguments
+
+    return "\n" + json.dumps({"function": name, "params": params}) + "\n"
+
+
+class AsyncChatContext:
+    """
+    Mixin that adds an asyncio run loop to a context backed by an OpenAI-compatible client.
+
+    The context is expected to provide `Messages`, `MessageQueue`, `QueuePointer`, `Model`,
+    `OnGenerate`, a `History` and a `client` exposing an async `chat.completions.create`.
+    `MessageClass` is the message type used for replies.
+
+    Failures matching `RetryableErrors` are retried up to `MaxRetries` times, and `Limiter`
+    paces requests against the provider's rate limits.
+
+    `PersistedCount` is the number of leading messages that have already been saved, and
+    `PendingTrim` the number of saved messages trimmed from the history since the last save.
+
+    `Tools`, a list of function calling schemas, is sent with every request. The calls the
+    model makes are generated into the reply as {"function": ..., "params": ...} lines,
+    each as soon as it is complete, so that they read like calls written out as text.
+    """
+
+    MessageClass: type = None
+    Tools: list[dict] | None = None
+
+    RetryableErrors: tuple[type[Exception], ...] = ()
+    MaxRetries: int = 4
+    Limiter: RateLimiter | None = None
+
+    PersistedCount: int = 0
+    PendingTrim: int = 0
+
+    def Prompt(self, message):
+        # System messages only set up the conversation, so they go straight into the history
+        # instead of costing a completion on the next run.
+        if message.Role == "system":
+            self.Messages.append(message)
+            return self
+
+        return super().Prompt(message)
+
+    async def RunAsync(self, *args, **kwargs):
+        while self.QueuePointer < len(self.MessageQueue):
+            await self.OnRunAsync(*args, **kwargs)
+            self.QueuePointer += 1
+
+        return self
+
+    async def OnRunAsync(self, *args, **kwargs) -> Any:
+        queued = self.MessageQueue[self.QueuePointer]
+
+        messages = self.History.Build(self.Messages, queued)
+
+        logger.debug("Sending ~%d tokens to %s", self.History.LastTokens, self.Model.Name)
+
+        stream: bool | None = kwargs.get("stream")
+
+        if stream is None:
+            stream = False
+
+        try:
+            content = await self.Complete(messages, stream=stream)
+
+        except Exception as e:
+            logger.error("Completion from %s failed: %s", self.Model.Name, e)
+            raise e
+
+        self.Messages.append(queued)
+        self.Messages.append(self.MessageClass("assistant", content or ""))
+
+        return self.Messages[-1]
+
+    async def Complete(self, messages: list[dict], stream: bool = False) -> str:
+        """
+        Requests a completion, retrying rate limited and transient failures with jittered
+        exponential backoff as long as nothing has been generated yet. Every attempt waits
+        for the context's `Limiter`, if it has one, and feeds the response headers back to it.
+        """
+        attempt = 0
+
+        while True:
+            generated = False
+
+            if self.Limiter is not None:
+                await self.Limiter.Acquire(
+                    sum(EstimateTokens(message["content"]) for message in messages)
+                    + (EstimateTokens(json.dumps(self.Tools)) if self.Tools else 0)
+                )
+
+            start = time.perf_counter()
+
+            try:
+                raw = await self.client.chat.completions.with_raw_response.create(
+                    model=self.Model.Name,
+                    messages=messages,
+                    temperature=0,
+                    stream=stream,
+                    **({"tools": self.Tools} if self.Tools else {}),
+                )
+
+                if self.Limiter is not None:
+                    self.Limiter.Update(raw.headers)
+
+                response = raw.parse()
+
+                if inspect.isawaitable(response):
+                    response = await response
+
+                if not stream:
+                    message = response.choices[0].message
+                    content = "".join(
+                        [message.content or ""]
+                        + [
+                            ToolCallLine(call.function.name, call.function.arguments)
+                            for call in message.tool_calls or []
+                        ]
+                    )
+                    self.ObserveCompletion(messages, content, Usage(response), start)
+                    self.OnGenerate(content)
+                    return content
+
+                tokens = TokenStream(self.OnGenerate)
+                usage = None
+
+                started = False
+
+                # Tool calls stream in as fragments of their JSON arguments, by index.
+                calls: dict[int, list[str]] = {}
+
+                async for chunk in response:
+                    usage = Usage(chunk) or usage
+
+                    if not chunk.choices:
+                        continue
+
+                    delta = chunk.choices[0].delta
+                    chunk_content = delta.content
+
+                    if not started and (chunk_content is not None or delta.tool_calls):
+                        started = True
+                        LLM_TIME_TO_FIRST_TOKEN_SECONDS.labels(model=self.Model.Name).observe(
+                            time.perf_counter() - start
+                        )
+
+                    if chunk_content is not None:
+                        generated = True
+                        tokens.Write(chunk_content)
+
+                    for call in delta.tool_calls or []:
+                        # A call is complete once the next one starts.
+                        for index in sorted(index for index in calls if index < call.index):
+                            generated = True
+                            tokens.Write(ToolCallLine(*calls.pop(index)))
+
+                        fragments = calls.setdefault(call.index, ["", ""])
+
+                        if call.function is not None:
+                            fragments[0] += call.function.name or ""
+                            fragments[1] += call.function.arguments or ""
+
+                for index in sorted(calls):
+                    generated = True
+                    tokens.Write(ToolCallLine(*calls[index]))
+
+                content = tokens.Text()
+
+                self.ObserveCompletion(messages, content, usage, None)
+
+                return content
+
+            except self.RetryableErrors as e:
+                headers = getattr(getattr(e, "response", None), "headers", None)
+
+                if self.Limiter is not None:
+                    self.Limiter.Update(headers)
+
+                if generated or attempt >= self.MaxRetries:
+                    raise
+
+                retryAfter = ParseDuration(headers.get("retry-after")) if headers else None
+                delay = RetryDelay(attempt, retryAfter)
+
+                logger.warning("Retrying %s in %.2fs after: %s", self.Model.Name, delay, e)
+
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def ObserveCompletion(
+        self, messages: list[dict], content: str | None, usage: Any, start: float | None
+    ):
+        """
+        Records the token counts of a finished completion, estimating them when the provider
+        didn't report usage. A non-streamed completion's first token arrives with the rest of
+        it, so its time to first token is measured from `start`.
+        """
+        if start is not None:
+            LLM_TIME_TO_FIRST_TOKEN_SECONDS.labels(model=self.Model.Name).observe(
+                time.perf_counter() - start
+            )
+
+        if usage is not None:
+            promptTokens, completionTokens = usage.prompt_tokens, usage.completion_tokens
+
+        else:
+            promptTokens = sum(EstimateTokens(message["content"]) for message in messages)
+            completionTokens = EstimateTokens(content or "")
+
+        LLM_TOKENS.labels(model=self.Model.Name, kind="prompt").observe(promptTokens)
+        LLM_TOKENS.labels(model=self.Model.Name, kind="completion").observe(completionTokens)
+
+    def CountTokens(self) -> int:
+        return sum(EstimateTokens(message.Content) for message in self.Messages)
+
+    def TrimHistory(self, maxTokens: int) -> int:
+        """
+        Drops the oldest non-system messages until the history fits in maxTokens.
+        System messages are always kept. Returns the number of messages dropped.
+
+        Dropped messages that were already persisted are counted in `PendingTrim` so that
+        the session journal can drop them too.
+        """
+        total = self.CountTokens()
+        kept = []
+        dropped = 0
+        droppedPersisted = 0
+
+        for i, message in enumerate(self.Messages):
+            if total > maxTokens and message.Role != "system":
+                total -= EstimateTokens(message.Content)
+                dropped += 1
+
+                if i < self.PersistedCount:
+                    droppedPersisted += 1
+
+                continue
+
+            kept.append(message)
+
+        if dropped:
+            self.Messages = kept
+            self.PersistedCount -= droppedPersisted
+            self.PendingTrim += droppedPersisted
+
+        return dropped
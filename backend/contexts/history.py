@@ -0,0 +1,109 @@
+import os
+
+
+def EstimateTokens(text: str | None) -> int:
+    """
+    Rough token count for budgeting, assuming ~4 characters per token plus per-message overhead.
+    """
+    return len(text or "") // 4 + 4
+
+
+def DropOldest(messages: list, count: int) -> list:
+    """
+    Returns messages without its first `count` non-system messages, mirroring the way
+    contexts trim their history.
+    """
+    kept = []
+
+    for message in messages:
+        if count > 0 and message.Role != "system":
+            count -= 1
+            continue
+
+        kept.append(message)
+
+    return kept
+
+
+class History:
+    """
+    Builds the message list sent to the model for each request, within a token budget.
+
+    - The leading system messages form a stable prefix that is serialized once and reused
+      for as long as those messages are unchanged.
+    - Tool outputs (messages of type "tool_result") older than the last `keepToolResults`
+      are replaced with a short placeholder.
+    - The oldest remaining messages are dropped until the request fits in `maxTokens`.
+      The prefix and the pending message are always sent.
+
+    `LastTokens` holds the estimated size of the last request, `TotalTokens` the sum over
+    all requests built so far.
+    """
+
+    ToolResultPlaceholder = "[Earlier tool results omitted]"
+
+    def __init__(
+        self,
+        maxTokens: int = int(os.getenv("LLM_HISTORY_TOKENS", 6000)),
+        keepToolResults: int = 1,
+    ):
+        self.MaxTokens = maxTokens
+        self.KeepToolResults = keepToolResults
+
+        self.LastTokens = 0
+        self.TotalTokens = 0
+        self.Requests = 0
+
+        self._prefixKey: tuple = ()
+        self._prefix: list[dict] = []
+        self._prefixTokens = 0
+
+    def Build(self, messages: list, pending) -> list[dict]:
+        prefixLength = 0
+
+        while prefixLength < len(messages) and messages[prefixLength].Role == "system":
+            prefixLength += 1
+
+        self._UpdatePrefix(messages[:prefixLength])
+
+        rest = messages[prefixLength:]
+        toolResults = [
+            index
+            for index, message in enumerate(rest)
+            if getattr(message, "Type", None) == "tool_result"
+        ]
+        stale = set(toolResults[: max(len(toolResults) - self.KeepToolResults, 0)])
+
+        bodies = [
+            {"role": message.Role, "content": History.ToolResultPlaceholder}
+            if index in stale
+            else message.ToDict()
+            for index, message in enumerate(rest)
+        ]
+        sizes = [EstimateTokens(body["content"]) for body in bodies]
+
+        pendingBody = pending.ToDict()
+        budget = self.MaxTokens - self._prefixTokens - EstimateTokens(pendingBody["content"])
+
+        total = sum(sizes)
+        start = 0
+
+        while start < len(bodies) and total > budget:
+            total -= sizes[start]
+            start += 1
+
+        self.LastTokens = self._prefixTokens + total + EstimateTokens(pendingBody["content"])
+        self.TotalTokens += self.LastTokens
+        self.Requests += 1
+
+        return self._prefix + bodies[start:] + [pendingBody]
+
+    def _UpdatePrefix(self, prefix: list):
+        key = tuple((id(message), len(message.Content or "")) for message in prefix)
+
+        if key == self._prefixKey:
+            return
+
+        self._prefixKey = key
+        self._prefix = [message.ToDict() for message in prefix]
+        self._prefixTokens = sum(EstimateTokens(message.Content) for message in prefix)
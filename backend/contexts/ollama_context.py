@@ -1,7 +1,14 @@
 import json
+import logging
+import threading
 from tinytune.llmcontext import LLMContext, Model, Message
+from contexts.history import History
 from typing import Any, override
 import openai
+from contexts.async_context import AsyncChatContext
+from contexts.token_stream import TokenStream
+
+logger = logging.getLogger(__name__)
 
 class OllamaMessage(Message):
     __slots__ = ("Role", "Content", "Type")
@@ -16,10 +23,14 @@ class OllamaContext(LLMContext[OllamaMessage]):
 
         self.Messages: list[OllamaMessage] = []
         self.QueuePointer: int = 0
-        self.Client = openai.OpenAI(base_url=baseUrl, api_key="ollama")
+        self.History = History()
+        self.Client = self.CreateClient(baseUrl)
 
         self.PromptFile = promptFile
 
+    def CreateClient(self, baseUrl: str):
+        return openai.OpenAI(base_url=baseUrl, api_key="ollama")
+
     def LoadMessages(self, promptFile: str = "prompts.json") -> None:
         self.PromptFile = promptFile
 
@@ -34,7 +45,7 @@ class OllamaContext(LLMContext[OllamaMessage]):
                 json.dump([message.ToDict() for message in self.Messages], fp, indent=2)
 
         except:
-            print("An error occurred in saving messages.")
+            logger.exception("An error occurred in saving messages.")
             return self
 
         return self
@@ -45,9 +56,9 @@ class OllamaContext(LLMContext[OllamaMessage]):
 
     @override
     def OnRun(self, *args, **kwargs):
-        messages = [message.ToDict() for message in self.Messages] + [
-            self.MessageQueue[self.QueuePointer].ToDict()
-        ]
+        messages = self.History.Build(
+            self.Messages, self.MessageQueue[self.QueuePointer]
+        )
 
         stream: bool | None = kwargs.get("stream")
 
@@ -65,11 +76,12 @@ class OllamaContext(LLMContext[OllamaMessage]):
             content = ""
 
             if stream:
+                tokens = TokenStream(self.OnGenerate)
+
                 for chunk in response:
-                    chunk_content = chunk.choices[0].delta.content
-                    if chunk_content is not None:
-                        content += chunk_content
-                        self.OnGenerate(chunk_content)
+                    tokens.Write(chunk.choices[0].delta.content)
+
+                content = tokens.Text()
             else:
                 content = response.choices[0].message.content
                 self.OnGenerate(content)
@@ -78,11 +90,36 @@ class OllamaContext(LLMContext[OllamaMessage]):
                 self.Messages.append(OllamaMessage("assistant", content))
 
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.error("An error occurred: %s", e)
             raise e
 
         return OllamaMessage("assistant", content)
 
+_clients: dict[str, openai.AsyncOpenAI] = {}
+_clientsLock = threading.Lock()
+
+def SharedAsyncOpenAI(baseUrl: str) -> openai.AsyncOpenAI:
+    """
+    Returns the process-wide AsyncOpenAI client for the server at baseUrl, so that every
+    context reuses its pooled connections. Retries are left to AsyncChatContext.
+    """
+    with _clientsLock:
+        if baseUrl not in _clients:
+            _clients[baseUrl] = openai.AsyncOpenAI(base_url=baseUrl, api_key="ollama", max_retries=0)
+
+        return _clients[baseUrl]
+
+class AsyncOllamaContext(AsyncChatContext, OllamaContext):
+    MessageClass = OllamaMessage
+    RetryableErrors = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+    def CreateClient(self, baseUrl: str):
+        return SharedAsyncOpenAI(baseUrl)
+
+    @property
+    def client(self):
+        return self.Client
+
 class O1Context(LLMContext[OllamaMessage]):
     def __init__(self, model: str, apiKey: str, promptFile: str | None = None):
         super().__init__(Model("openai", model))
@@ -90,6 +127,7 @@ class O1Context(LLMContext[OllamaMessage]):
         self.APIKey: str = apiKey
         self.Messages: list[OllamaMessage] = []
         self.QueuePointer: int = 0
+        self.History = History()
 
         openai.api_key = self.APIKey
 
@@ -109,7 +147,7 @@ class O1Context(LLMContext[OllamaMessage]):
                 json.dump([message.ToDict() for message in self.Messages], fp, indent=2)
 
         except:
-            print("An error occurred in saving messages.")
+            logger.exception("An error occurred in saving messages.")
             return self
 
         return self
@@ -120,9 +158,9 @@ class O1Context(LLMContext[OllamaMessage]):
 
     @override
     def OnRun(self, *args, **kwargs):
-        messages = [message.ToDict() for message in self.Messages] + [
-            self.MessageQueue[self.QueuePointer].ToDict()
-        ]
+        messages = self.History.Build(
+            self.Messages, self.MessageQueue[self.QueuePointer]
+        )
 
         stream: bool | None = kwargs.get("stream")
 
@@ -140,11 +178,12 @@ class O1Context(LLMContext[OllamaMessage]):
             content = ""
 
             if stream:
+                tokens = TokenStream(self.OnGenerate)
+
                 for chunk in response:
-                    chunk_content = chunk.choices[0].delta.content
-                    if chunk_content is not None:
-                        content += chunk_content
-                        self.OnGenerate(chunk_content)
+                    tokens.Write(chunk.choices[0].delta.content)
+
+                content = tokens.Text()
             else:
                 content = response.choices[0].message.content
                 self.OnGenerate(content)
@@ -153,7 +192,7 @@ class O1Context(LLMContext[OllamaMessage]):
                 self.Messages.append(OllamaMessage("assistant", content))
 
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.error("An error occurred: %s", e)
             raise e
 
         return OllamaMessage("assistant", content)
@@ -0,0 +1,176 @@
+import re
+import time
+import random
+import asyncio
+from typing import Callable, Mapping
+
+
+def ParseDuration(value: str | None) -> float | None:
+    """
+    Parses the durations used in rate limit headers ("7.66s", "2m59.56s", "1h2m", "120ms"
+    or plain seconds) into seconds.
+    """
+    if not value:
+        return None
+
+    try:
+        return float(value)
+
+    except ValueError:
+        pass
+
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+
+    if not parts:
+        return None
+
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def RetryDelay(attempt: int, retryAfter: float | None = None, base: float = 0.5, cap: float = 20.0) -> float:
+    """
+    Exponential backoff with full jitter, never shorter than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2**attempt))
+
+    return max(delay, retryAfter or 0.0)
+
+
+class TokenBucket:
+    """
+    Refills `limit` units per minute, up to `limit`. A limit of None never blocks.
+    """
+
+    def __init__(self, limit: float | None, clock: Callable[[], float] = time.monotonic):
+        self.Limit = limit
+        self.Clock = clock
+        self.Level = limit or 0.0
+        self.Updated = clock()
+
+    def WaitTime(self, amount: float) -> float:
+        if self.Limit is None:
+            return 0.0
+
+        self._Refill()
+
+        # Requests larger than the whole bucket only wait for a full one.
+        amount = min(amount, self.Limit)
+
+        if self.Level >= amount:
+            return 0.0
+
+        return (amount - self.Level) * 60.0 / self.Limit
+
+    def Take(self, amount: float):
+        if self.Limit is not None:
+            self._Refill()
+            self.Level -= amount
+
+    def SetLimit(self, limit: float):
+        if self.Limit is None:
+            self.Level = limit
+            self.Updated = self.Clock()
+
+        elif limit != self.Limit:
+            self._Refill()
+            self.Level = min(self.Level, limit)
+
+        self.Limit = limit
+
+    def SetRemaining(self, remaining: float):
+        if self.Limit is not None:
+            self._Refill()
+            self.Level = min(self.Level, remaining)
+
+    def _Refill(self):
+        now = self.Clock()
+        self.Level = min(self.Limit, self.Level + (now - self.Updated) * self.Limit / 60.0)
+        self.Updated = now
+
+
+class RateLimiter:
+    """
+    Client-side limiter for requests and tokens per minute, shared by every context using
+    the same provider key.
+
+    Callers wait in `Acquire` in FIFO order until both buckets have room, so bursts are
+    spread out instead of turning into 429s. `Update` feeds the provider's rate limit headers
+    back in: the token limit and remaining budget correct the local estimate, and an
+    exhausted request quota or a Retry-After pauses every caller until it resets.
+    """
+
+    def __init__(
+        self,
+        requestsPerMinute: float | None = None,
+        tokensPerMinute: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.Clock = clock
+        self.Requests = TokenBucket(requestsPerMinute, clock)
+        self.Tokens = TokenBucket(tokensPerMinute, clock)
+
+        self.BlockedUntil = 0.0
+        self.Waited = 0.0
+        self.Throttled = 0
+
+        self._lock: asyncio.Lock | None = None
+
+    async def Acquire(self, tokens: int):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                wait = max(
+                    self.Requests.WaitTime(1),
+                    self.Tokens.WaitTime(tokens),
+                    self.BlockedUntil - self.Clock(),
+                )
+
+                if wait <= 0:
+                    break
+
+                self.Throttled += 1
+                self.Waited += wait
+
+                await asyncio.sleep(wait)
+
+            self.Requests.Take(1)
+            self.Tokens.Take(tokens)
+
+    def Backoff(self, seconds: float):
+        self.BlockedUntil = max(self.BlockedUntil, self.Clock() + seconds)
+
+    def Update(self, headers: Mapping[str, str] | None):
+        if not headers:
+            return
+
+        limitTokens = headers.get("x-ratelimit-limit-tokens")
+        remainingTokens = headers.get("x-ratelimit-remaining-tokens")
+        remainingRequests = headers.get("x-ratelimit-remaining-requests")
+
+        try:
+            if limitTokens is not None:
+                self.Tokens.SetLimit(float(limitTokens))
+
+            if remainingTokens is not None:
+                self.Tokens.SetRemaining(float(remainingTokens))
+
+            if remainingRequests is not None and float(remainingRequests) <= 0:
+                self.Backoff(ParseDuration(headers.get("x-ratelimit-reset-requests")) or 1.0)
+
+        except ValueError:
+            pass
+
+        retryAfter = ParseDuration(headers.get("retry-after"))
+
+        if retryAfter is not None:
+            self.Backoff(retryAfter)
+
+    def Stats(self) -> dict:
+        return {
+            "throttled": self.Throttled,
+            "waited_seconds": self.Waited,
+            "tokens_available": self.Tokens.Level if self.Tokens.Limit is not None else None,
+        }
@@ -0,0 +1,390 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from tinytune.llmcontext import LLMContext, Model
+from contexts.history import History
+from contexts.async_context import AsyncChatContext
+from contexts.ratelimit import ParseDuration
+from contexts.GroqContext import AsyncWebGroqContext, WebGroqMessage
+from contexts.ollama_context import AsyncOllamaContext
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats:
+    """
+    Live health of one provider, shared by every router in the process.
+
+    `Latency` is an EWMA of the time to first token and `ErrorRate` an EWMA of failures
+    (1) and successes (0). After a rate limit, or `MaxFailures` failures in a row, the
+    provider cools down and gets no traffic until a health check passes.
+    """
+
+    Alpha = 0.2
+    MaxFailures = 3
+    Cooldown = 30.0
+
+    def __init__(self, name: str):
+        self.Name = name
+
+        self.Latency: float | None = None
+        self.ErrorRate = 0.0
+        self.Samples: deque[float] = deque(maxlen=200)
+
+        self.Requests = 0
+        self.Failures = 0
+        self.ConsecutiveFailures = 0
+        self.CooldownUntil = 0.0
+        self.Probing = False
+
+    def Healthy(self, now: float) -> bool:
+        return now >= self.CooldownUntil and not self.Probing
+
+    def Score(self) -> float:
+        """
+        Expected time to first token, inflated by the error rate. Providers without samples
+        score 0 so that each gets tried, unless they have only ever failed, which ranks them
+        last.
+        """
+        if self.Latency is None:
+            return math.inf if self.Failures else 0.0
+
+        return self.Latency * (1 + 4 * self.ErrorRate)
+
+    def P95(self) -> float | None:
+        if len(self.Samples) < 20:
+            return None
+
+        samples = sorted(self.Samples)
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def Success(self, latency: float):
+        self.Requests += 1
+        self.ConsecutiveFailures = 0
+        self.Samples.append(latency)
+
+        self.Latency = (
+            latency if self.Latency is None else self.Alpha * latency + (1 - self.Alpha) * self.Latency
+        )
+        self.ErrorRate = (1 - self.Alpha) * self.ErrorRate
+
+    def Failure(self, error: BaseException, now: float):
+        self.Requests += 1
+        self.Failures += 1
+        self.ConsecutiveFailures += 1
+        self.ErrorRate = self.Alpha + (1 - self.Alpha) * self.ErrorRate
+
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+
+        if status == 429:
+            retryAfter = ParseDuration(response.headers.get("retry-after"))
+            self.CooldownUntil = now + (retryAfter if retryAfter is not None else self.Cooldown)
+
+        elif self.ConsecutiveFailures >= self.MaxFailures:
+            self.CooldownUntil = now + self.Cooldown
+
+    def Stats(self) -> dict:
+        return {
+            "latency": round(self.Latency, 4) if self.Latency is not None else None,
+            "p95": round(p95, 4) if (p95 := self.P95()) is not None else None,
+            "error_rate": round(self.ErrorRate, 4),
+            "requests": self.Requests,
+            "failures": self.Failures,
+            "cooling_down": time.monotonic() < self.CooldownUntil,
+        }
+
+
+_stats: dict[str, ProviderStats] = {}
+_statsLock = threading.Lock()
+
+def SharedProviderStats(name: str) -> ProviderStats:
+    with _statsLock:
+        if name not in _stats:
+            _stats[name] = ProviderStats(name)
+
+        return _stats[name]
+
+def ProvidersStats() -> dict:
+    return {name: stats.Stats() for name, stats in _stats.items()}
+
+
+def CreateProvider(spec: str, apiKey: str) -> AsyncChatContext:
+    """
+    Creates a provider context from a spec:
+
+    - "groq:<model>" uses Groq with apiKey.
+    - "ollama:<model>" or "ollama:<model>@<base url>" uses an Ollama (or any other
+      OpenAI-compatible) server, OLLAMA_BASE_URL by default.
+    """
+    kind, _, model = spec.partition(":")
+
+    if kind == "groq":
+        return AsyncWebGroqContext(model, apiKey)
+
+    if kind == "ollama":
+        model, _, baseUrl = model.partition("@")
+        return AsyncOllamaContext(
+            baseUrl or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1"), model
+        )
+
+    raise ValueError(f"Unknown LLM provider '{spec}'")
+
+
+class Committed(Exception):
+    """
+    Raised from a race when the provider that already streamed tokens fails.
+    """
+
+
+class AsyncRouterContext(AsyncChatContext, LLMContext[WebGroqMessage]):
+    """
+    Context that sends each completion to one of several provider contexts.
+
+    Providers are ranked by their shared ProviderStats, and the fastest healthy one gets
+    the request. If it fails before producing a token, or produces none within
+    `FirstTokenTimeout` seconds, the request fails over to the next one. Once tokens have
+    been streamed the request is committed to that provider.
+
+    With `Hedge` set, a second request goes to the runner-up when the first hasn't produced
+    a token by the leader's p95 time to first token (`HedgeAfter` until there are enough
+    samples). Whichever streams first wins and the other is cancelled.
+    """
+
+    MessageClass = WebGroqMessage
+
+    def __init__(
+        self,
+        providers: list[AsyncChatContext],
+        hedge: bool = os.getenv("LLM_HEDGE", "0") == "1",
+        hedgeAfter: float = float(os.getenv("LLM_HEDGE_AFTER", 2.0)),
+        firstTokenTimeout: float = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", 30.0)),
+        clock=time.monotonic,
+    ):
+        super().__init__(Model("router", "+".join(provider.Model.Name for provider in providers)))
+
+        self.Messages: list[WebGroqMessage] = []
+        self.History = History()
+
+        self.Providers = providers
+        self.Stats = [
+            SharedProviderStats(f"{type(provider).__name__}:{provider.Model.Name}")
+            for provider in providers
+        ]
+
+        self.Hedge = hedge
+        self.HedgeAfter = hedgeAfter
+        self.FirstTokenTimeout = firstTokenTimeout
+        self.Clock = clock
+
+        self.Hedges = 0
+        self.Failovers = 0
+
+        # With several providers, failing over beats waiting out a provider's backoff.
+        if len(providers) > 1:
+            for provider in providers:
+                provider.MaxRetries = 0
+
+        self._probes: set[asyncio.Task] = set()
+
+    def Rank(self) -> list[int]:
+        """
+        Returns the indices of the healthy providers, best first. Providers whose cooldown
+        has run out get a health check first. If none is healthy, all are returned.
+        """
+        now = self.Clock()
+
+        for i, stats in enumerate(self.Stats):
+            if stats.CooldownUntil and now >= stats.CooldownUntil and not stats.Probing:
+                stats.Probing = True
+                task = asyncio.create_task(self.HealthCheck(i))
+                self._probes.add(task)
+                task.add_done_callback(self._probes.discard)
+
+        healthy = [i for i, stats in enumerate(self.Stats) if stats.Healthy(now)]
+
+        return sorted(healthy or range(len(self.Providers)), key=lambda i: self.Stats[i].Score())
+
+    async def HealthCheck(self, index: int):
+        """
+        Lists the provider's models. A provider that answers is put back into rotation.
+        """
+        stats = self.Stats[index]
+
+        try:
+            await asyncio.wait_for(self.Providers[index].client.models.list(), 5.0)
+            stats.CooldownUntil = 0.0
+            stats.ConsecutiveFailures = 0
+
+        except Exception as e:
+            logger.warning("Health check of %s failed: %s", stats.Name, e)
+            stats.CooldownUntil = self.Clock() + stats.Cooldown
+
+        finally:
+            stats.Probing = False
+
+    async def Complete(self, messages: list[dict], stream: bool = False) -> str:
+        ranked = self.Rank()
+        error: BaseException | None = None
+
+        while ranked:
+            primary = ranked.pop(0)
+            hedge = ranked[0] if self.Hedge and ranked else None
+
+            try:
+                content, used = await self.Race(primary, hedge, messages, stream)
+
+            except Committed as e:
+                raise e.__cause__
+
+            except Exception as e:
+                error = e
+                self.Failovers += 1
+
+                if hedge is not None:
+                    ranked.remove(hedge)
+
+                logger.warning("%s, failing over: %s", self.Stats[primary].Name, e)
+                continue
+
+            return content
+
+        raise error
+
+    async def Race(self, primary: int, hedge: int | None, messages: list[dict], stream: bool):
+        """
+        Runs the request on primary, and on hedge as well if primary is slow to produce its
+        first token. Returns the content and the index of the provider that produced it.
+        """
+        winner: int | None = None
+        tasks: dict[int, asyncio.Task] = {}
+
+        def Forward(index: int):
+            def OnToken(token):
+                nonlocal winner
+
+                if winner is None:
+                    winner = index
+
+                    for other, task in tasks.items():
+                        if other != index:
+                            task.cancel()
+
+                if winner == index:
+                    self.OnGenerate(token)
+
+            return OnToken
+
+        tasks[primary] = asyncio.create_task(self.Call(primary, messages, stream, Forward(primary)))
+
+        start = self.Clock()
+        hedgeAt = start + (self.Stats[primary].P95() or self.HedgeAfter) if hedge is not None else None
+        deadline = start + self.FirstTokenTimeout
+        error: BaseException | None = None
+
+        try:
+            while tasks:
+                now = self.Clock()
+
+                if winner is None:
+                    timeout = max(min(deadline, hedgeAt or deadline) - now, 0)
+                else:
+                    timeout = None
+
+                done, _ = await asyncio.wait(
+                    tasks.values(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for index, task in list(tasks.items()):
+                    if task not in done:
+                        continue
+
+                    del tasks[index]
+
+                    if task.cancelled():
+                        continue
+
+                    if task.exception() is None:
+                        return task.result(), index
+
+                    if winner == index:
+                        raise Committed() from task.exception()
+
+                    error = task.exception()
+
+                if winner is not None:
+                    continue
+
+                now = self.Clock()
+
+                # The hedge is started when the primary is slow, or right away if it failed.
+                if hedgeAt is not None and (now >= hedgeAt or not tasks):
+                    hedgeAt = None
+                    self.Hedges += 1
+                    tasks[hedge] = asyncio.create_task(
+                        self.Call(hedge, messages, stream, Forward(hedge))
+                    )
+
+                elif now >= deadline:
+                    for index in tasks:
+                        self.Stats[index].Failure(asyncio.TimeoutError(), now)
+
+                    raise asyncio.TimeoutError(
+                        f"No token within {self.FirstTokenTimeout}s from {self.Stats[primary].Name}"
+                    )
+
+            raise error
+
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def Call(self, index: int, messages: list[dict], stream: bool, onToken) -> str:
+        provider = self.Providers[index]
+        stats = self.Stats[index]
+
+        start = self.Clock()
+        firstToken: float | None = None
+
+        def OnGenerate(token):
+            nonlocal firstToken
+
+            if firstToken is None:
+                firstToken = self.Clock() - start
+
+            onToken(token)
+
+        provider.OnGenerate = OnGenerate
+        provider.Tools = self.Tools
+
+        try:
+            content = await provider.Complete(messages, stream=stream)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            stats.Failure(e, self.Clock())
+            raise
+
+        stats.Success(firstToken if firstToken is not None else self.Clock() - start)
+
+        return content
+
+
+def CreateContext(apiKey: str, model: str = "llama-3.1-70b-versatile") -> AsyncChatContext:
+    """
+    Returns the context a chat stage talks to. LLM_PROVIDERS, a comma separated list of
+    provider specs (see CreateProvider), routes between several providers; otherwise Groq
+    is used directly.
+    """
+    specs = [spec.strip() for spec in os.getenv("LLM_PROVIDERS", "").split(",") if spec.strip()]
+
+    if not specs:
+        return AsyncWebGroqContext(model, apiKey)
+
+    return AsyncRouterContext([CreateProvider(spec, apiKey) for spec in specs])
@@ -0,0 +1,56 @@
+from typing import Any, Callable
+
+
+class TokenStream:
+    """
+    Accumulates streamed chunks in linear time and fans them out to subscribers.
+
+    Chunks are kept in a list and joined only when `Text()` is called, and the joined text
+    is kept until the next write, so reading the result costs one copy instead of one per
+    chunk. Every subscriber receives each chunk as it is written, in subscription order.
+    """
+
+    __slots__ = ("_chunks", "_length", "_subscribers")
+
+    def __init__(self, *subscribers: Callable[[str], Any]):
+        self._chunks: list[str] = []
+        self._length = 0
+        self._subscribers: list[Callable[[str], Any]] = list(subscribers)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __str__(self) -> str:
+        return self.Text()
+
+    def Subscribe(self, callback: Callable[[str], Any]) -> Callable[[], None]:
+        """
+        Calls callback with every chunk written from now on. Returns a function that
+        unsubscribes it.
+        """
+        self._subscribers.append(callback)
+
+        return lambda: self._subscribers.remove(callback)
+
+    def Write(self, chunk: str | None):
+        if not chunk:
+            return
+
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+
+        for subscriber in self._subscribers:
+            subscriber(chunk)
+
+    def Text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+
+        return self._chunks[0] if self._chunks else ""
+
+    def Clear(self):
+        self._chunks = []
+        self._length = 0
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any
+
+from metrics import TOOL_CALL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCallBatch:
+    """
+    Runs the tool calls of one agent reply concurrently.
+
+    At most `concurrency` calls run at once and each is cancelled after `timeout` seconds.
+    Every submitted entry gets its own slot in `results()`, in submission order, so repeated
+    calls to the same function don't overwrite each other and one failing call doesn't
+    take the others down with it.
+
+    Agent output can be streamed in through `feed`: the agent replies with one JSON object
+    per line, so each call is started as soon as its line is complete, while the rest of the
+    reply is still being generated. A malformed line only fails its own entry, and lines of
+    plain text, as written by an agent using native tool calls, are kept as one general
+    response message.
+    """
+
+    def __init__(
+        self,
+        yt,
+        concurrency: int = int(os.getenv("YT_CALL_CONCURRENCY", 4)),
+        timeout: float = float(os.getenv("YT_CALL_TIMEOUT", 15)),
+    ):
+        self.yt = yt
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        self._entries: list[asyncio.Task | dict] = []
+
+        self._parts: list[str] = []
+        self._text: dict | None = None
+
+    def feed(self, chunk: str):
+        """
+        Consumes a chunk of the agent's streamed reply, submitting every line it completes.
+        """
+        if "\n" not in chunk:
+            self._parts.append(chunk)
+            return
+
+        lines = chunk.split("\n")
+
+        self._parts.append(lines[0])
+        self._submit_line("".join(self._parts))
+
+        for line in lines[1:-1]:
+            self._submit_line(line)
+
+        self._parts = [lines[-1]]
+
+    def finish(self):
+        """
+        Submits the last, unterminated line of a fed reply.
+        """
+        self._submit_line("".join(self._parts))
+        self._parts = []
+
+    def _submit_line(self, line: str):
+        line = line.strip()
+
+        if not line:
+            return
+
+        if not line.startswith(("{", "[")):
+            if self._text is None:
+                self._text = {"message": line}
+                self._entries.append({"general": {"response": self._text}})
+
+            else:
+                self._text["message"] += "\n" + line
+
+            return
+
+        self._text = None
+
+        try:
+            call = json.loads(line)
+
+        except ValueError as e:
+            logger.warning("Malformed agent line %r: %s", line, e)
+            self._entries.append({"general": {"error": {"message": f"Malformed call: {e}"}}})
+            return
+
+        self.submit(call)
+
+    def submit(self, call: dict):
+        """
+        Schedules a parsed agent line. Lines without a "function" key are general
+        responses and are passed through as {"general": line}, and calls whose params
+        aren't an object fail on their own.
+        """
+        if not isinstance(call, dict) or "function" not in call:
+            self._entries.append({"general": call})
+            return
+
+        if not isinstance(call.get("params", {}), dict):
+            self._entries.append(
+                {
+                    "function": call["function"],
+                    "params": {},
+                    "error": f"Malformed arguments: {call['params']}",
+                }
+            )
+            return
+
+        self._entries.append(asyncio.create_task(self._run(call)))
+
+    async def results(self) -> list[dict]:
+        return [
+            await entry if isinstance(entry, asyncio.Task) else entry
+            for entry in self._entries
+        ]
+
+    def cancel(self):
+        for entry in self._entries:
+            if isinstance(entry, asyncio.Task):
+                entry.cancel()
+
+    async def _run(self, call: dict) -> dict[str, Any]:
+        name = call["function"]
+        params = dict(call.get("params", {}))
+
+        entry = {"function": name, "params": dict(params)}
+        outcome = "ok"
+        start = time.perf_counter()
+
+        async with self.semaphore:
+            try:
+                entry["result"] = await asyncio.wait_for(
+                    self.yt.call_method({"function": name, "params": params}),
+                    self.timeout,
+                )
+
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                entry["error"] = f"Call to '{name}' timed out after {self.timeout}s"
+
+            except Exception as e:
+                outcome = "error"
+                entry["error"] = str(e)
+
+        TOOL_CALL_SECONDS.labels(function=name, outcome=outcome).observe(
+            time.perf_counter() - start
+        )
+
+        logger.debug("Call response: %s", entry)
+
+        return entry
@@ -0,0 +1,184 @@
+from records import SearchResult, as_dict
+
+
+def _video_from_search(item: SearchResult | dict) -> dict:
+    item = as_dict(item)
+
+    return {
+        "id": item["videoId"],
+        "title": item["title"],
+        "description": item["description"],
+        "channelTitle": item["channelTitle"],
+        "publishedAt": item["publishedAt"],
+        "thumbnailUrl": item["thumbnailUrl"],
+        "videoUrl": item["videoUrl"],
+    }
+
+
+def _search_videos(entry: dict, data: dict):
+    for item in entry["result"]:
+        _add(data["videos"], _video_from_search(item))
+
+
+def _get_video_details(entry: dict, data: dict):
+    for video_id, details in entry["result"].items():
+        _add(data["videos"], {"id": video_id, **as_dict(details)})
+
+
+def _get_channel_info(entry: dict, data: dict):
+    if entry["result"] is None:
+        data["misc"].setdefault("notFound", []).append(entry["params"].get("channel_id"))
+        return
+
+    _add(data["channels"], {"id": entry["params"].get("channel_id"), **as_dict(entry["result"])})
+
+
+def _search_channels(entry: dict, data: dict):
+    for item in entry["result"]:
+        channel = as_dict(item)
+        channel["id"] = channel.pop("channelId")
+        _add(data["channels"], channel)
+
+
+def _get_playlist_items(entry: dict, data: dict):
+    for item in entry["result"]:
+        video = as_dict(item)
+        video["id"] = video.pop("videoId")
+        _add(data["videos"], video)
+
+    _add(
+        data["playlists"],
+        {"id": entry["params"].get("playlist_id"), "itemCount": len(entry["result"])},
+    )
+
+
+def _get_comments(entry: dict, data: dict):
+    comments = data["misc"].setdefault("comments", {})
+    comments.setdefault(entry["params"].get("video_id"), []).extend(
+        as_dict(comment) for comment in entry["result"]
+    )
+
+
+def _get_video_categories(entry: dict, data: dict):
+    data["misc"].setdefault("categories", []).extend(
+        as_dict(category) for category in entry["result"]
+    )
+
+
+HANDLERS = {
+    "search_videos": _search_videos,
+    "get_video_details": _get_video_details,
+    "get_channel_info": _get_channel_info,
+    "search_channels": _search_channels,
+    "get_playlist_items": _get_playlist_items,
+    "get_comments": _get_comments,
+    "get_video_categories": _get_video_categories,
+}
+
+
+def _add(records: dict, record: dict):
+    # The same video or channel often comes back from several calls (e.g. search_videos
+    # followed by get_video_details), so records with the same id are merged.
+    if record.get("id") in records:
+        records[record.get("id")].update(record)
+
+    else:
+        records[record.get("id")] = record
+
+
+def format_responses(responses) -> dict:
+    """
+    Maps the results collected by Execute into the response schema of FORMATTER_PROMPT,
+    without an LLM round-trip.
+    Args:
+        responses (list | dict): The Execute output, either a list of call entries whose
+            results may be records, or {"error": message} when the agent reply could not
+            be executed.
+    Returns:
+        dict: {"response": {...}, "remarks": str}, with only the populated parts kept.
+            Remarks hold the agent's general messages, if any.
+    """
+    if isinstance(responses, dict):
+        responses = [{"general": responses}]
+
+    data = {"videos": {}, "channels": {}, "playlists": {}, "misc": {}}
+    misc = {}
+    errors = []
+    messages = []
+
+    for entry in responses:
+        if "general" in entry:
+            general = entry["general"]
+
+            if not isinstance(general, dict):
+                messages.append(str(general))
+
+            elif "response" in general:
+                response = general["response"]
+                messages.append(
+                    str(response.get("message", response)) if isinstance(response, dict) else str(response)
+                )
+
+            elif "error" in general:
+                error = general["error"]
+                errors.append(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+
+            else:
+                misc.setdefault("general", []).append(general)
+
+            continue
+
+        if "error" in entry:
+            errors.append(f"{entry['function']}: {entry['error']}")
+            continue
+
+        handler = HANDLERS.get(entry["function"])
+
+        if handler is None:
+            misc.setdefault(entry["function"], []).append(entry["result"])
+            continue
+
+        handler(entry, data)
+
+    response = {
+        "success": not errors or bool(
+            data["videos"] or data["channels"] or data["playlists"] or data["misc"] or messages
+        ),
+        "data": {
+            key: list(value.values()) if key != "misc" else value
+            for key, value in data.items()
+            if value
+        },
+    }
+
+    if misc:
+        response["misc"] = misc
+
+    if errors:
+        response["error"] = {"code": 500, "message": "; ".join(errors)}
+
+    return {"response": response, "remarks": "\n\n".join(messages)}
+
+
+def summarize(formatted: dict) -> str:
+    """
+    Builds plain remarks for a formatted response without an LLM call.
+    """
+    if formatted["remarks"]:
+        return formatted["remarks"]
+
+    response = formatted["response"]
+    data = response["data"]
+
+    parts = [
+        f"{len(data[key])} {key if len(data[key]) != 1 else key[:-1]}"
+        for key in ("videos", "channels", "playlists")
+        if key in data
+    ]
+
+    remarks = f"Found {', '.join(parts)}." if parts else ""
+
+    if "error" in response:
+        remarks = f"{remarks} Some requests failed: {response['error']['message']}".strip()
+
+    return remarks
@@ -0,0 +1,143 @@
+import re
+import json
+from urllib.parse import urlsplit, parse_qs
+
+# Rule-based routing of inputs whose plan is obvious from the text alone, such as a pasted
+# video URL or "comments on <url>". Matching inputs get their plan without a YTAgent call.
+
+URL = re.compile(
+    r"(?:https?://)?(?:(?:www|m|music)\.)?(?:youtube\.com|youtu\.be)/[^\s<>\"']+", re.IGNORECASE
+)
+HANDLE = re.compile(r"(?<![\w@/.])@[\w.-]{2,29}[\w-](?![\w@])")
+
+VIDEO_ID = re.compile(r"[\w-]{11}")
+CHANNEL_ID = re.compile(r"UC[\w-]{22}")
+PLAYLIST_ID = re.compile(r"[\w-]{12,64}")
+
+VIDEO_PATHS = ("shorts", "embed", "live", "v")
+
+COMMENTS = {"comment", "comments"}
+
+# Words that may surround the URLs or handles of an obvious request. Anything else, like
+# "compare" or "similar", may need more than a lookup and is left to the agent.
+FILLER = {
+    "a", "about", "all", "and", "can", "check", "comment", "comments", "describe", "detail",
+    "details", "fetch", "find", "for", "from", "get", "give", "i", "in", "info", "information",
+    "is", "it", "items", "list", "look", "me", "of", "on", "out", "please", "pls", "read",
+    "see", "show", "stats", "statistics", "tell", "that", "the", "these", "this", "those",
+    "up", "us", "video", "videos", "channel", "channels", "playlist", "playlists", "what",
+    "whats", "what's", "who", "whos", "who's", "you",
+}
+
+# Words asking about a channel. With only videos or playlists, get_video_details and
+# get_playlist_items don't answer them.
+CHANNEL_WORDS = {"channel", "channels", "who", "whos", "who's"}
+
+# Words asking for a listing. They fit a video or a playlist, but with a channel they ask
+# for its videos, which get_channel_info doesn't return.
+LISTING = {"all", "items", "list", "video", "videos"}
+
+
+def parse_url(url: str) -> tuple[str, str] | None:
+    """
+    Returns the kind ("video", "playlist" or "channel") and id a YouTube URL points to, or
+    None when it is something else. Channel ids may be @handles.
+    """
+    url = url.rstrip(".,;:!?)]")
+
+    if "://" not in url:
+        url = "https://" + url
+
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    segments = [segment for segment in parts.path.split("/") if segment]
+    query = parse_qs(parts.query)
+
+    def valid(pattern: re.Pattern, value: str | None, kind: str):
+        return (kind, value) if value and pattern.fullmatch(value) else None
+
+    if host.endswith("youtu.be"):
+        return valid(VIDEO_ID, segments[0] if segments else None, "video")
+
+    if not segments:
+        return None
+
+    if segments[0] == "watch":
+        return valid(VIDEO_ID, query.get("v", [None])[0], "video") or valid(
+            PLAYLIST_ID, query.get("list", [None])[0], "playlist"
+        )
+
+    if segments[0] == "playlist":
+        return valid(PLAYLIST_ID, query.get("list", [None])[0], "playlist")
+
+    if segments[0] in VIDEO_PATHS and len(segments) > 1:
+        return valid(VIDEO_ID, segments[1], "video")
+
+    # Pages under a channel, like /@handle/videos or /channel/<id>/shorts, are listings
+    # that get_channel_info doesn't return.
+    if segments[0] == "channel" and len(segments) == 2:
+        return valid(CHANNEL_ID, segments[1], "channel")
+
+    if segments[0].startswith("@") and len(segments) == 1:
+        return valid(HANDLE, segments[0], "channel")
+
+    return None
+
+
+def route_intent(text: str) -> str | None:
+    """
+    Returns the plan for an input that only names videos, channels or playlists, one
+    {"function": ..., "params": ...} call per line like the YTAgent's replies, or None if
+    the input needs the agent.
+    """
+    targets: dict[str, list[str]] = {"video": [], "playlist": [], "channel": []}
+
+    for match in URL.finditer(text):
+        target = parse_url(match.group())
+
+        if target is None:
+            return None
+
+        kind, id = target
+
+        if id not in targets[kind]:
+            targets[kind].append(id)
+
+    rest = URL.sub(" ", text)
+
+    for handle in HANDLE.findall(rest):
+        if handle not in targets["channel"]:
+            targets["channel"].append(handle)
+
+    words = re.findall(r"[\w']+", HANDLE.sub(" ", rest).casefold())
+
+    filler = FILLER - LISTING if targets["channel"] else FILLER - CHANNEL_WORDS
+
+    if not any(targets.values()) or not filler.issuperset(words):
+        return None
+
+    calls = []
+
+    if COMMENTS.intersection(words):
+        if not targets["video"] or targets["playlist"] or targets["channel"]:
+            return None
+
+        calls.extend(
+            {"function": "get_comments", "params": {"video_id": id}} for id in targets["video"]
+        )
+
+    elif targets["video"]:
+        calls.append(
+            {"function": "get_video_details", "params": {"video_ids": ",".join(targets["video"])}}
+        )
+
+    calls.extend(
+        {"function": "get_playlist_items", "params": {"playlist_id": id}}
+        for id in targets["playlist"]
+    )
+    calls.extend(
+        {"function": "get_channel_info", "params": {"channel_id": id}}
+        for id in targets["channel"]
+    )
+
+    return "\n".join(json.dumps(call) for call in calls)
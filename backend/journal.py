@@ -0,0 +1,452 @@
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+from typing import Any, Callable
+
+
+class VersionConflict(Exception):
+    """
+    Raised when a chat was saved by someone else since it was loaded.
+    """
+
+    def __init__(self, chat_id: str, expected: int, actual: int):
+        super().__init__(
+            f"Chat {chat_id} is at version {actual}, expected {expected}. Reload it and try again."
+        )
+        self.chat_id = chat_id
+        self.expected = expected
+        self.actual = actual
+
+
+def pending_changes(contexts: dict[str, Any]) -> tuple[list[tuple[str, int]], list[tuple]]:
+    """
+    Collects what changed in each context since its last save: the number of persisted
+    messages its history was trimmed by, and its new non-system messages. The contexts are
+    left as they are; `mark_saved` marks them once the changes are written.
+    """
+    trims = []
+    appends = []
+
+    for name, context in contexts.items():
+        if context.PendingTrim:
+            trims.append((name, context.PendingTrim))
+
+        appends.extend(
+            (name, message.Role, message.Content, getattr(message, "Type", "message"))
+            for message in context.Messages[context.PersistedCount :]
+            if message.Role != "system"
+        )
+
+    return trims, appends
+
+
+def mark_saved(contexts: dict[str, Any], counts: dict[str, int]):
+    """
+    Marks the first counts[name] messages of each context as saved, along with its trims.
+    """
+    for name, context in contexts.items():
+        context.PersistedCount = counts[name]
+        context.PendingTrim = 0
+
+
+class SessionJournal(ABC):
+    """
+    Where chat sessions are persisted, so they can be shared between workers and survive
+    restarts.
+
+    Each save only writes what a chat's contexts changed since their last save: new messages
+    are appended and messages trimmed from the history are deleted, so the cost of a turn
+    doesn't grow with the length of the conversation. System messages are not journaled:
+    they are the same for every chat and are recreated by `YTChat.Setup` on restore.
+
+    Every chat has a version that each save increments. A save must name the version it
+    was based on and fails with VersionConflict if the chat has moved on since.
+    """
+
+    def __init__(self):
+        self.loads = 0
+        self.appended = 0
+        self.trimmed = 0
+        self.conflicts = 0
+
+    @abstractmethod
+    async def load(self, chat_id: str) -> tuple[dict[str, list[dict]], int] | None:
+        """
+        Returns the journaled messages of chat_id by context name, oldest first, and its
+        version, or None if the chat isn't in the journal.
+        """
+
+    @abstractmethod
+    async def version(self, chat_id: str) -> int:
+        """
+        Returns the current version of chat_id, 0 if it has never been saved.
+        """
+
+    async def save(self, chat_id: str, contexts: dict[str, Any], version: int) -> int:
+        """
+        Journals the changes of contexts on top of `version` and returns the new version.
+        """
+        trims, appends = pending_changes(contexts)
+        counts = {name: len(context.Messages) for name, context in contexts.items()}
+
+        try:
+            version = await self._save(chat_id, version, trims, appends)
+
+        except VersionConflict:
+            self.conflicts += 1
+            raise
+
+        # Only once written: after a failed save the same changes are retried next time.
+        mark_saved(contexts, counts)
+
+        self.appended += len(appends)
+        self.trimmed += sum(count for _, count in trims)
+
+        return version
+
+    @abstractmethod
+    async def delete(self, chat_id: str):
+        """
+        Removes chat_id and its messages from the journal.
+        """
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "loads": self.loads,
+            "appended": self.appended,
+            "trimmed": self.trimmed,
+            "conflicts": self.conflicts,
+        }
+
+    @abstractmethod
+    async def _save(
+        self, chat_id: str, version: int, trims: list[tuple[str, int]], appends: list[tuple]
+    ) -> int:
+        """
+        Writes trims and appends if chat_id is still at `version`, and returns the new
+        version. Raises VersionConflict otherwise.
+        """
+
+
+class MemoryJournal(SessionJournal):
+    """
+    In-process journal. Messages stay in the session store's chats, so only versions are
+    tracked here, and chats are lost with the process. Every request for a chat gets the
+    same chat object, so there is no stale copy to conflict with, and saves always succeed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._versions: dict[str, int] = {}
+
+    async def load(self, chat_id: str):
+        return None
+
+    async def version(self, chat_id: str) -> int:
+        return self._versions.get(chat_id, 0)
+
+    async def delete(self, chat_id: str):
+        self._versions.pop(chat_id, None)
+
+    async def _save(self, chat_id, version, trims, appends) -> int:
+        self._versions[chat_id] = self._versions.get(chat_id, 0) + 1
+
+        return self._versions[chat_id]
+
+
+class SqliteJournal(SessionJournal):
+    """
+    Journal in an SQLite WAL database, which can be shared by the workers of one machine.
+
+    Chats that haven't been saved to for `retention` seconds are deleted when the journal
+    is opened.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        retention: float = 7 * 86400,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__()
+
+        self.clock = clock
+
+        self._dbLock = threading.Lock()
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (chat_id TEXT PRIMARY KEY, updated_at REAL)"
+        )
+
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(sessions)")]
+
+        if "version" not in columns:
+            self._db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                chat_id TEXT,
+                context TEXT,
+                seq INTEGER,
+                role TEXT,
+                content TEXT,
+                type TEXT,
+                PRIMARY KEY (chat_id, context, seq)
+            ) WITHOUT ROWID
+            """
+        )
+        self._db.commit()
+
+        self._expire(clock() - retention)
+
+    async def load(self, chat_id: str):
+        result = await asyncio.to_thread(self._read, chat_id)
+
+        if result is None:
+            return None
+
+        self.loads += 1
+
+        rows, version = result
+        messages: dict[str, list[dict]] = {}
+
+        for context, role, content, type in rows:
+            messages.setdefault(context, []).append(
+                {"role": role, "content": content, "type": type}
+            )
+
+        return messages, version
+
+    async def version(self, chat_id: str) -> int:
+        return await asyncio.to_thread(self._version, chat_id)
+
+    async def delete(self, chat_id: str):
+        await asyncio.to_thread(self._delete, chat_id)
+
+    async def _save(self, chat_id, version, trims, appends) -> int:
+        return await asyncio.to_thread(self._write, chat_id, version, trims, appends)
+
+    def _read(self, chat_id: str):
+        with self._dbLock, self._db:
+            row = self._db.execute(
+                "SELECT version FROM sessions WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            rows = self._db.execute(
+                "SELECT context, role, content, type FROM messages WHERE chat_id = ? ORDER BY context, seq",
+                (chat_id,),
+            ).fetchall()
+
+            return rows, row[0]
+
+    def _version(self, chat_id: str) -> int:
+        with self._dbLock:
+            row = self._db.execute(
+                "SELECT version FROM sessions WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+
+            return row[0] if row is not None else 0
+
+    def _write(self, chat_id: str, version: int, trims: list[tuple[str, int]], appends: list[tuple]):
+        with self._dbLock, self._db:
+            # The version check and bump is a single statement, so it is atomic across
+            # processes sharing the file.
+            if version == 0:
+                cursor = self._db.execute(
+                    """
+                    INSERT INTO sessions (chat_id, updated_at, version) VALUES (?, ?, 1)
+                    ON CONFLICT (chat_id) DO UPDATE
+                    SET version = 1, updated_at = excluded.updated_at WHERE sessions.version = 0
+                    """,
+                    (chat_id, self.clock()),
+                )
+
+            else:
+                cursor = self._db.execute(
+                    "UPDATE sessions SET version = version + 1, updated_at = ? WHERE chat_id = ? AND version = ?",
+                    (self.clock(), chat_id, version),
+                )
+
+            if cursor.rowcount == 0:
+                row = self._db.execute(
+                    "SELECT version FROM sessions WHERE chat_id = ?", (chat_id,)
+                ).fetchone()
+
+                raise VersionConflict(chat_id, version, row[0] if row is not None else 0)
+
+            for context, count in trims:
+                self._db.execute(
+                    """
+                    DELETE FROM messages WHERE chat_id = ? AND context = ? AND seq IN (
+                        SELECT seq FROM messages WHERE chat_id = ? AND context = ?
+                        ORDER BY seq LIMIT ?
+                    )
+                    """,
+                    (chat_id, context, chat_id, context, count),
+                )
+
+            for context, role, content, type in appends:
+                self._db.execute(
+                    """
+                    INSERT INTO messages (chat_id, context, seq, role, content, type)
+                    SELECT ?, ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ?
+                    FROM messages WHERE chat_id = ? AND context = ?
+                    """,
+                    (chat_id, context, role, content, type, chat_id, context),
+                )
+
+            return version + 1
+
+    def _delete(self, chat_id: str):
+        with self._dbLock, self._db:
+            self._db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self._db.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+
+    def _expire(self, deadline: float):
+        with self._dbLock, self._db:
+            self._db.execute(
+                "DELETE FROM messages WHERE chat_id IN (SELECT chat_id FROM sessions WHERE updated_at < ?)",
+                (deadline,),
+            )
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (deadline,))
+
+
+class RedisJournal(SessionJournal):
+    """
+    Journal in a Redis-protocol server, which can be shared by workers on any number of
+    machines. Each context is a list of JSON messages and the version a counter next to
+    them. Saves are optimistic WATCH/MULTI transactions on the version key. Every save
+    resets the chat's expiry to `retention` seconds.
+
+    Requires the `redis` package.
+    """
+
+    def __init__(self, url: str, retention: float = 7 * 86400, prefix: str = "ytchat:session"):
+        try:
+            import redis.asyncio
+            import redis.exceptions
+
+        except ImportError as e:
+            raise RuntimeError("The redis session backend requires the 'redis' package") from e
+
+        super().__init__()
+
+        self.retention = int(retention)
+        self.prefix = prefix
+
+        self._redis = redis.asyncio.from_url(url, decode_responses=True)
+        self._watchError = redis.exceptions.WatchError
+
+    def _key(self, chat_id: str, *parts: str) -> str:
+        return ":".join((self.prefix, chat_id, *parts))
+
+    async def load(self, chat_id: str):
+        contexts = sorted(await self._redis.smembers(self._key(chat_id, "contexts")))
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.get(self._key(chat_id, "version"))
+
+            for context in contexts:
+                pipe.lrange(self._key(chat_id, "context", context), 0, -1)
+
+            version, *lists = await pipe.execute()
+
+        if version is None:
+            return None
+
+        self.loads += 1
+
+        return {
+            context: [json.loads(message) for message in messages]
+            for context, messages in zip(contexts, lists)
+        }, int(version)
+
+    async def version(self, chat_id: str) -> int:
+        return int(await self._redis.get(self._key(chat_id, "version")) or 0)
+
+    async def delete(self, chat_id: str):
+        contexts = await self._redis.smembers(self._key(chat_id, "contexts"))
+
+        await self._redis.delete(
+            self._key(chat_id, "version"),
+            self._key(chat_id, "contexts"),
+            *(self._key(chat_id, "context", context) for context in contexts),
+        )
+
+    async def _save(self, chat_id, version, trims, appends) -> int:
+        versionKey = self._key(chat_id, "version")
+
+        messages: dict[str, list[str]] = {}
+
+        for context, role, content, type in appends:
+            messages.setdefault(context, []).append(
+                json.dumps({"role": role, "content": content, "type": type})
+            )
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(versionKey)
+
+                actual = int(await pipe.get(versionKey) or 0)
+
+                if actual != version:
+                    raise VersionConflict(chat_id, version, actual)
+
+                contexts = await pipe.smembers(self._key(chat_id, "contexts"))
+
+                pipe.multi()
+
+                for context, count in trims:
+                    pipe.ltrim(self._key(chat_id, "context", context), count, -1)
+
+                for context, values in messages.items():
+                    pipe.rpush(self._key(chat_id, "context", context), *values)
+                    pipe.sadd(self._key(chat_id, "contexts"), context)
+
+                pipe.set(versionKey, version + 1)
+
+                for key in [versionKey, self._key(chat_id, "contexts")] + [
+                    self._key(chat_id, "context", context) for context in contexts | set(messages)
+                ]:
+                    pipe.expire(key, self.retention)
+
+                await pipe.execute()
+
+            except self._watchError:
+                raise VersionConflict(chat_id, version, await self.version(chat_id))
+
+        return version + 1
+
+
+def open_journal(url: str | None, retention: float = 7 * 86400) -> SessionJournal:
+    """
+    Opens the session journal described by url:
+
+    - None or "memory": chats only live in this process.
+    - "sqlite:///path/to/sessions.db": an SQLite file, shared by the workers of one machine.
+    - "redis://host:port/db": a Redis-protocol server, shared by any number of machines.
+    """
+    if url is None or url == "memory":
+        return MemoryJournal()
+
+    parsed = urlparse(url)
+
+    if parsed.scheme == "sqlite":
+        return SqliteJournal(url[len("sqlite:///") :], retention=retention)
+
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisJournal(url, retention=retention)
+
+    raise ValueError(f"Unknown session backend '{url}'")
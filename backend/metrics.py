@@ -0,0 +1,73 @@
+import time
+import contextlib
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+STAGE_SECONDS = Histogram(
+    "ytchat_stage_seconds",
+    "Time spent in each stage of a prompt.",
+    ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+
+TOOL_CALL_SECONDS = Histogram(
+    "ytchat_tool_call_seconds",
+    "Time taken by each tool call made by the agent, including time spent waiting for a slot.",
+    ["function", "outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16),
+)
+
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending a completion request to receiving its first token.",
+    ["model"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8),
+)
+
+LLM_TOKENS = Histogram(
+    "llm_tokens",
+    "Tokens per completion request, by kind (prompt or completion).",
+    ["model", "kind"],
+    buckets=(16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+
+LLM_RESULT_TOKENS = Histogram(
+    "llm_result_tokens",
+    "Estimated tokens of the tool output sent to an LLM per request, by stage and encoding "
+    "(json for the full output, compact for what was sent).",
+    ["stage", "encoding"],
+    buckets=(64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+
+YOUTUBE_REQUEST_SECONDS = Histogram(
+    "youtube_request_seconds",
+    "Latency of YouTube Data API requests, by method and HTTP status.",
+    ["method", "status"],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4),
+)
+
+PLANS = Counter(
+    "ytchat_plans",
+    "YTAgent plans, by where they came from (intent router, plan cache or agent).",
+    ["source"],
+)
+
+
+@contextlib.contextmanager
+def span(histogram: Histogram, **labels):
+    """
+    Observes the time spent in the with block on the histogram, whether or not it raises.
+    """
+    start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def render() -> tuple[bytes, str]:
+    """
+    Returns the metrics of this process in the Prometheus text format, and its content type.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
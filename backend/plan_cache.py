@@ -0,0 +1,169 @@
+import re
+import json
+import time
+from collections import OrderedDict
+from typing import Callable
+
+# Parameters that pick an option rather than carry something from the user's text.
+OPTION_PARAMS = {"order", "video_duration", "video_type", "region_code", "max_results"}
+
+
+def tokenize(text: str) -> frozenset[str]:
+    return frozenset(re.findall(r"[\w@]+", text.casefold()))
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.findall(r"[\w@]+", text.casefold()))
+
+
+class PlanCache:
+    """
+    Caches YTAgent plans (its one-JSON-call-per-line replies) by user input.
+
+    Inputs are matched exactly after normalization (case, punctuation and whitespace), or
+    fuzzily when the token-set similarity with a cached input reaches `similarity`. Entries
+    expire after `ttl` seconds and the least recently used one is dropped past
+    `max_entries`.
+
+    Only grounded plans are stored: every call must name a function, and every free-text
+    parameter must come from the input itself. Plans that refer to ids or text from earlier
+    in the conversation depend on that conversation and are never shared.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 600.0,
+        similarity: float = 0.85,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.clock = clock
+
+        self._entries: OrderedDict[str, tuple[float, frozenset[str], str]] = OrderedDict()
+
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.rejected = 0
+
+    def get(self, text: str) -> str | None:
+        key = normalize(text)
+        now = self.clock()
+
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[0] <= now:
+            del self._entries[key]
+            entry = None
+
+        if entry is None and self.similarity < 1:
+            tokens = tokenize(text)
+            key, entry = self._closest(tokens, now)
+
+            # A similar input may differ in exactly the words the plan's parameters use
+            # ("pasta" vs "rice"), so the plan has to be grounded in this input too.
+            if entry is not None and not self._grounded(tokens, entry[2]):
+                entry = None
+
+            if entry is not None:
+                self.fuzzy_hits += 1
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+        return entry[2]
+
+    def put(self, text: str, plan: str) -> bool:
+        """
+        Stores plan for text if it is grounded in text. Returns whether it was stored.
+        """
+        tokens = tokenize(text)
+
+        if not self._grounded(tokens, plan):
+            self.rejected += 1
+            return False
+
+        key = normalize(text)
+
+        self._entries[key] = (self.clock() + self.ttl, tokens, plan.strip())
+        self._entries.move_to_end(key)
+        self.stored += 1
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        return True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stored": self.stored,
+            "rejected": self.rejected,
+        }
+
+    def _closest(self, tokens: frozenset[str], now: float):
+        best = (None, None)
+        bestScore = self.similarity
+
+        if not tokens:
+            return best
+
+        for key, entry in self._entries.items():
+            if entry[0] <= now:
+                continue
+
+            score = len(tokens & entry[1]) / len(tokens | entry[1])
+
+            if score >= bestScore:
+                best = (key, entry)
+                bestScore = score
+
+        return best
+
+    def _grounded(self, tokens: frozenset[str], plan: str) -> bool:
+        lines = [line for line in plan.strip().split("\n") if line.strip()]
+
+        if not lines:
+            return False
+
+        for line in lines:
+            try:
+                call = json.loads(line)
+
+            except ValueError:
+                return False
+
+            if not isinstance(call, dict) or "function" not in call:
+                return False
+
+            params = call.get("params", {})
+
+            if not isinstance(params, dict):
+                return False
+
+            for name, value in params.items():
+                if name in OPTION_PARAMS:
+                    continue
+
+                # Native tool calls pass lists, e.g. of video ids, where agent lines used a
+                # comma separated string.
+                for item in value if isinstance(value, list) else [value]:
+                    if not isinstance(item, str) or not tokenize(item) <= tokens:
+                        return False
+
+        return True
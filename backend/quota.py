@@ -0,0 +1,138 @@
+import time
+import datetime
+from typing import Callable
+from zoneinfo import ZoneInfo
+
+# Quota cost of each YouTube Data API method, in units.
+COSTS = {
+    "youtube.search.list": 100,
+    "youtube.videos.list": 1,
+    "youtube.channels.list": 1,
+    "youtube.playlistItems.list": 1,
+    "youtube.commentThreads.list": 1,
+    "youtube.videoCategories.list": 1,
+}
+
+# The daily quota resets at midnight Pacific Time.
+RESET_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QuotaLedger:
+    """
+    Tracks YouTube Data API quota spent today and decides which calls may still be made.
+
+    - Every call is charged its cost from COSTS, and a call that no longer fits in what is
+      left of `daily_budget` is refused.
+    - Once the remaining quota drops below `reserve` units, calls costing more than one unit
+      (search) are refused, so the cheap lookups keep working for the rest of the day.
+    - A token bucket holding up to `burst` units, refilled at `daily_budget` units per day,
+      paces spending so a traffic spike can't burn the whole day's quota at once.
+    """
+
+    def __init__(
+        self,
+        daily_budget: int = 10000,
+        reserve: int = 1000,
+        burst: int = 2000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.daily_budget = daily_budget
+        self.reserve = reserve
+        self.burst = burst
+        self.clock = clock
+
+        self.spent = 0
+        self.spent_by_method: dict[str, int] = {}
+        self.refused = 0
+        self.calls = 0
+
+        self._bucket = float(burst)
+        self._bucketUpdated = clock()
+        self._resetAt = self._next_reset()
+
+    @property
+    def remaining(self) -> int:
+        self._roll_over()
+        return max(self.daily_budget - self.spent, 0)
+
+    def charge(self, method_id: str):
+        """
+        Charges the cost of one call to method_id, or raises QuotaExceeded if it isn't allowed.
+        """
+        cost = COSTS.get(method_id, 1)
+        remaining = self.remaining
+
+        self._refill()
+
+        if cost > remaining:
+            self._refuse("YouTube quota exhausted until the daily reset", self._resetAt - self.clock())
+
+        if cost > 1 and remaining - cost < self.reserve:
+            self._refuse(
+                f"YouTube quota is low ({remaining} units left), {method_id} is disabled until the daily reset",
+                self._resetAt - self.clock(),
+            )
+
+        if cost > self._bucket:
+            rate = self.daily_budget / 86400
+            self._refuse(
+                f"YouTube quota is being spent too fast, {method_id} is paused",
+                (cost - self._bucket) / rate,
+            )
+
+        self._bucket -= cost
+        self.spent += cost
+        self.spent_by_method[method_id] = self.spent_by_method.get(method_id, 0) + cost
+        self.calls += 1
+
+    def exhaust(self):
+        """
+        Marks today's quota as used up, e.g. after the API itself answered quotaExceeded.
+        """
+        self._roll_over()
+        self.spent = max(self.spent, self.daily_budget)
+
+    def stats(self) -> dict:
+        self._refill()
+
+        return {
+            "daily_budget": self.daily_budget,
+            "spent": self.spent,
+            "remaining": self.remaining,
+            "bucket": round(self._bucket, 2),
+            "calls": self.calls,
+            "refused": self.refused,
+            "spent_by_method": dict(self.spent_by_method),
+            "resets_in": round(self._resetAt - self.clock()),
+        }
+
+    def _refuse(self, message: str, retry_after: float):
+        self.refused += 1
+        raise QuotaExceeded(message, max(retry_after, 0.0))
+
+    def _refill(self):
+        now = self.clock()
+        rate = self.daily_budget / 86400
+
+        self._bucket = min(self.burst, self._bucket + (now - self._bucketUpdated) * rate)
+        self._bucketUpdated = now
+
+    def _roll_over(self):
+        if self.clock() >= self._resetAt:
+            self.spent = 0
+            self.spent_by_method = {}
+            self._resetAt = self._next_reset()
+
+    def _next_reset(self) -> float:
+        now = datetime.datetime.fromtimestamp(self.clock(), RESET_TIMEZONE)
+        midnight = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), datetime.time(), RESET_TIMEZONE
+        )
+
+        return midnight.timestamp()
@@ -0,0 +1,155 @@
+import json
+from dataclasses import dataclass
+from typing import Any, ClassVar
+
+try:
+    import orjson
+
+except ImportError:
+    orjson = None
+
+# Result records returned by the YouTubeDataAPI tools. They are slotted dataclasses, so a
+# large page of results costs a fraction of the memory of one dict per item, and URLs that
+# follow from an id are computed when encoded rather than stored. `dumps` is the one
+# encoder for anything holding them, and uses orjson when it is installed.
+
+
+class Record:
+    __slots__ = ()
+
+    # Properties encoded after the fields.
+    derived: ClassVar[tuple[str, ...]] = ()
+
+    def to_dict(self) -> dict:
+        record = {name: getattr(self, name) for name in self.__slots__}
+
+        for name in self.derived:
+            record[name] = getattr(self, name)
+
+        return record
+
+
+def video_url(video_id: str) -> str:
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def channel_url(channel_id: str) -> str:
+    return f"https://www.youtube.com/channel/{channel_id}"
+
+
+@dataclass(slots=True)
+class SearchResult(Record):
+    videoId: str
+    title: str
+    description: str
+    channelTitle: str
+    publishedAt: str
+    thumbnailUrl: str
+
+    derived: ClassVar[tuple[str, ...]] = ("videoUrl",)
+
+    @property
+    def videoUrl(self) -> str:
+        return video_url(self.videoId)
+
+
+@dataclass(slots=True)
+class VideoDetails(Record):
+    id: str
+    title: str
+    description: str
+    viewCount: int
+    likeCount: int
+    commentCount: int
+    duration: str
+    thumbnailUrl: str
+
+    derived: ClassVar[tuple[str, ...]] = ("videoUrl",)
+
+    @property
+    def videoUrl(self) -> str:
+        return video_url(self.id)
+
+
+@dataclass(slots=True)
+class ChannelInfo(Record):
+    id: str
+    title: str
+    description: str
+    subscriberCount: int
+    viewCount: int
+    videoCount: int
+    thumbnailUrl: str
+
+    derived: ClassVar[tuple[str, ...]] = ("channelUrl",)
+
+    @property
+    def channelUrl(self) -> str:
+        return channel_url(self.id)
+
+
+@dataclass(slots=True)
+class ChannelResult(Record):
+    channelId: str
+    title: str
+    description: str
+    thumbnailUrl: str
+
+    derived: ClassVar[tuple[str, ...]] = ("channelUrl",)
+
+    @property
+    def channelUrl(self) -> str:
+        return channel_url(self.channelId)
+
+
+@dataclass(slots=True)
+class PlaylistItem(Record):
+    videoId: str
+    title: str
+    description: str
+    publishedAt: str
+    thumbnailUrl: str
+
+    derived: ClassVar[tuple[str, ...]] = ("videoUrl",)
+
+    @property
+    def videoUrl(self) -> str:
+        return video_url(self.videoId)
+
+
+@dataclass(slots=True)
+class Comment(Record):
+    author: str
+    text: str
+    likeCount: int
+    publishedAt: str
+
+
+@dataclass(slots=True)
+class Category(Record):
+    id: str
+    title: str
+
+
+def as_dict(value: Record | dict) -> dict:
+    """
+    Returns the fields of a record, or a copy of a dict, as a new dict.
+    """
+    return value.to_dict() if isinstance(value, Record) else dict(value)
+
+
+def _default(value: Any):
+    if isinstance(value, Record):
+        return value.to_dict()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> str:
+    """
+    Encodes value, which may hold records, as compact JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_PASSTHROUGH_DATACLASS).decode()
+
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":"))
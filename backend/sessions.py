@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+class SessionStore:
+    """
+    Bounded chat session store.
+
+    Sessions are kept in least-recently-used order and evicted when the store holds more
+    than `max_sessions` entries or when a session has been idle for longer than `idle_ttl`
+    seconds. After every turn `enforce_budget` trims a session's history down to
+    `max_tokens`. `on_evict(chat_id, session, reason)` is called for every eviction, with
+    reason being one of "lru", "ttl" or "manual".
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        idle_ttl: float = 1800.0,
+        max_tokens: int = 24000,
+        on_evict: Callable[[str, Any, str], Any] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_tokens = max_tokens
+        self.on_evict = on_evict
+        self.clock = clock
+
+        self._sessions: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"lru": 0, "ttl": 0, "manual": 0}
+        self.trimmed_messages = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._sessions
+
+    def get(self, chat_id: str):
+        """
+        Returns the session for chat_id, or None if it does not exist or has expired.
+        """
+        self._expire()
+
+        entry = self._sessions.get(chat_id)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._sessions[chat_id] = (entry[0], self.clock())
+        self._sessions.move_to_end(chat_id)
+
+        return entry[0]
+
+    def put(self, chat_id: str, session: Any):
+        self._sessions[chat_id] = (session, self.clock())
+        self._sessions.move_to_end(chat_id)
+
+        while len(self._sessions) > self.max_sessions:
+            oldest = next(iter(self._sessions))
+            self._evict(oldest, "lru")
+
+    def evict(self, chat_id: str):
+        if chat_id in self._sessions:
+            self._evict(chat_id, "manual")
+
+    def enforce_budget(self, chat_id: str):
+        """
+        Trims the history of chat_id's session if it exceeds the per-session token budget.
+        """
+        entry = self._sessions.get(chat_id)
+
+        if entry is None or entry[0].CountTokens() <= self.max_tokens:
+            return
+
+        self.trimmed_messages += entry[0].TrimHistory(self.max_tokens)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": dict(self.evictions),
+            "trimmed_messages": self.trimmed_messages,
+        }
+
+    def _expire(self):
+        deadline = self.clock() - self.idle_ttl
+
+        # Entries are ordered by last access, so expired ones are always at the front.
+        while self._sessions:
+            chat_id, (_, last_access) = next(iter(self._sessions.items()))
+
+            if last_access > deadline:
+                break
+
+            self._evict(chat_id, "ttl")
+
+    def _evict(self, chat_id: str, reason: str):
+        session, _ = self._sessions.pop(chat_id)
+        self.evictions[reason] += 1
+
+        if self.on_evict is not None:
+            self.on_evict(chat_id, session, reason)
@@ -1,19 +1,249 @@
 import os
+import re
 import sys
+import time
+import inspect
+import asyncio
+import logging
+import functools
+import contextlib
+import httpx
 from tinytune.tool import tool
 
 from googleapiclient.discovery import build
 from dotenv import load_dotenv
 
+from cache import ResponseCache, cached
+from coalesce import BatchCoalescer
+from quota import QuotaLedger, QuotaExceeded
+from metrics import YOUTUBE_REQUEST_SECONDS
+from records import (
+    SearchResult, VideoDetails, ChannelInfo, ChannelResult, PlaylistItem, Comment, Category
+)
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+@functools.cache
+def youtube_resource(api_key):
+    """
+    Builds the discovery client for an API key once per process. The discovery document is
+    the static copy bundled with googleapiclient, so this never touches the network. The
+    resource is only used to build requests, which makes sharing it across sessions safe.
+    YT_API_BASE points the requests at another server, e.g. the benchmark's fake API.
+    """
+    base = os.getenv("YT_API_BASE")
+
+    return build(
+        "youtube",
+        "v3",
+        developerKey=api_key,
+        static_discovery=True,
+        cache_discovery=False,
+        client_options={"api_endpoint": base} if base else None,
+    )
+
+@functools.cache
+def http_client():
+    """
+    Returns the process-wide HTTP client used for YouTube requests, keeping connections
+    to the API alive between sessions.
+    """
+    return httpx.AsyncClient(
+        timeout=10.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+
+@functools.cache
+def response_cache():
+    """
+    Returns the process-wide cache for tool responses. YT_CACHE_SIZE bounds the number of
+    entries kept in memory and YT_CACHE_DB enables the on-disk SQLite tier.
+    """
+    return ResponseCache(
+        max_entries=int(os.getenv("YT_CACHE_SIZE", 2048)),
+        db_path=os.getenv("YT_CACHE_DB"),
+        serve_stale_on=(QuotaExceeded,),
+    )
+
+@functools.cache
+def quota_ledger(api_key):
+    """
+    Returns the quota ledger for an API key. YT_DAILY_QUOTA sets the daily budget,
+    YT_QUOTA_RESERVE the units kept for cheap lookups once search is cut off and
+    YT_QUOTA_BURST how many units may be spent in a burst.
+
+    The ledger only sees this process's calls, so with several workers sharing a key each
+    one gets an even share of the three: they are divided by YT_QUOTA_WORKERS, which
+    defaults to WEB_CONCURRENCY (uvicorn's default worker count) or 1.
+    """
+    workers = max(int(os.getenv("YT_QUOTA_WORKERS") or os.getenv("WEB_CONCURRENCY") or 1), 1)
+
+    return QuotaLedger(
+        daily_budget=int(os.getenv("YT_DAILY_QUOTA", 10000)) // workers,
+        reserve=int(os.getenv("YT_QUOTA_RESERVE", 1000)) // workers,
+        burst=int(os.getenv("YT_QUOTA_BURST", 2000)) // workers,
+    )
+
+async def take(iterator, limit):
+    """
+    Collects up to `limit` items from an async iterator, then closes it so that no further
+    pages are requested.
+    """
+    items = []
+
+    try:
+        if limit > 0:
+            async for item in iterator:
+                items.append(item)
+
+                if len(items) >= limit:
+                    break
+
+    finally:
+        await iterator.aclose()
+
+    return items
+
+# Batched id lookups are shared by every YouTubeDataAPI instance using the same key.
+_loaders: dict[tuple[str, str], BatchCoalescer] = {}
+
+LOADER_PARTS = {
+    "videos": "snippet,contentDetails,statistics",
+    "channels": "snippet,statistics",
+}
+
+# Partial response masks, so that only the fields each method extracts are sent back.
+THUMBNAIL = "thumbnails/default/url"
+
+FIELDS = {
+    "videos": f"items(id,snippet(title,description,{THUMBNAIL}),contentDetails/duration,"
+    "statistics(viewCount,likeCount,commentCount))",
+    "channels": f"items(id,snippet(title,description,{THUMBNAIL}),"
+    "statistics(subscriberCount,viewCount,videoCount))",
+    "search_videos": "nextPageToken,items(id/videoId,"
+    f"snippet(title,description,channelTitle,publishedAt,{THUMBNAIL}))",
+    "search_channels": f"items(id/channelId,snippet(title,description,{THUMBNAIL}))",
+    "playlistItems": "nextPageToken,items/snippet("
+    f"title,description,publishedAt,{THUMBNAIL},resourceId/videoId)",
+    "commentThreads": "nextPageToken,items/snippet/topLevelComment/snippet("
+    "authorDisplayName,textDisplay,likeCount,publishedAt)",
+    "videoCategories": "items(id,snippet/title)",
+}
+
 class YouTubeDataAPI:
     def __init__(self, api_key):
         self.api_key = api_key
-        self.youtube = build("youtube", "v3", developerKey=self.api_key)
+        self.youtube = youtube_resource(self.api_key)
+        self.http = http_client()
+        self.cache = response_cache()
+        self.quota = quota_ledger(self.api_key)
+
+    async def _execute(self, request):
+        """
+        Executes a request built by the discovery client on the async HTTP client,
+        charging its cost to the key's quota ledger first.
+        Args:
+            request (HttpRequest): The request returned by a `.list(...)` call.
+        Returns:
+            dict: The decoded JSON response.
+        Raises:
+            QuotaExceeded: If the quota ledger refuses the call.
+        """
+        self.quota.charge(request.methodId)
+
+        start = time.perf_counter()
+        status = "error"
+
+        try:
+            response = await self.http.request(
+                request.method, request.uri, headers=request.headers, content=request.body
+            )
+            status = str(response.status_code)
+
+        finally:
+            YOUTUBE_REQUEST_SECONDS.labels(method=request.methodId, status=status).observe(
+                time.perf_counter() - start
+            )
+
+        if response.status_code == 403 and "quotaExceeded" in response.text:
+            self.quota.exhaust()
+
+        response.raise_for_status()
+
+        return response.json()
+
+    def loader(self, resource):
+        """
+        Returns the shared coalescer batching `resource().list(id=...)` lookups for this key.
+        Args:
+            resource (str): Either "videos" or "channels".
+        Returns:
+            BatchCoalescer: The coalescer for the resource.
+        """
+        key = (self.api_key, resource)
+
+        if key not in _loaders:
+            _loaders[key] = BatchCoalescer(
+                functools.partial(self._list_by_id, resource),
+                window=float(os.getenv("YT_BATCH_WINDOW_MS", 5)) / 1000,
+            )
+
+        return _loaders[key]
+
+    async def _list_by_id(self, resource, ids):
+        request = getattr(self.youtube, resource)().list(
+            part=LOADER_PARTS[resource], fields=FIELDS[resource], id=",".join(ids)
+        )
+        response = await self._execute(request)
+
+        return {item["id"]: item for item in response.get("items", [])}
+
+    async def _pages(self, list_method, prefetch=True, limit=None, **params):
+        """
+        Yields the response pages of `list_method(**params)`, following nextPageToken until
+        `limit` items have been received, if given. With prefetch, the next page is
+        requested as soon as the current one is yielded; closing the generator cancels
+        that request.
+        """
+        pending = asyncio.ensure_future(self._execute(list_method(**params)))
+        received = 0
+
+        try:
+            while pending is not None:
+                response = await pending
+                pending = None
+
+                received += len(response.get("items", []))
+                token = response.get("nextPageToken")
+
+                # Pages already holding what was asked for aren't followed.
+                if limit is not None and received >= limit:
+                    token = None
+
+                if token is not None and prefetch:
+                    pending = asyncio.ensure_future(
+                        self._execute(list_method(**params, pageToken=token))
+                    )
+
+                yield response
+
+                if token is None:
+                    return
+
+                if pending is None:
+                    pending = asyncio.ensure_future(
+                        self._execute(list_method(**params, pageToken=token))
+                    )
+
+        finally:
+            if pending is not None:
+                pending.cancel()
 
     @tool
-    def search_videos(
+    @cached(ttl=15 * 60)
+    async def search_videos(
         self,
         query,
         max_results=5,
@@ -30,194 +260,304 @@ class YouTubeDataAPI:
             video_duration (str): Duration of the videos to search for.
             video_type (str): Type of videos to search for.
         Returns:
-            list: A list of dictionaries containing video information.
+            list: A list of SearchResult records.
         """
-        request = self.youtube.search().list(
+        max_results = int(max_results)
+
+        return await take(
+            self.iter_search_videos(
+                query,
+                order=order,
+                video_duration=video_duration,
+                video_type=video_type,
+                page_size=min(max_results, 50),
+                prefetch=max_results > 50,
+                limit=max_results,
+            ),
+            max_results,
+        )
+
+    async def iter_search_videos(
+        self,
+        query,
+        order="relevance",
+        video_duration="any",
+        video_type="any",
+        page_size=50,
+        prefetch=True,
+        limit=None,
+    ):
+        """
+        Lazily iterates over every video matching a search, one result page at a time.
+        Args:
+            query (str): The search query.
+            order (str): The order of the search results.
+            video_duration (str): Duration of the videos to search for.
+            video_type (str): Type of videos to search for.
+            page_size (int): Results fetched per request, at most 50.
+            prefetch (bool): Fetch the next page while the current one is consumed.
+            limit (int): Stop requesting pages once this many items were received.
+        Yields:
+            SearchResult: Video information, in the same shape as search_videos.
+        """
+        pages = self._pages(
+            self.youtube.search().list,
+            prefetch,
+            limit,
             q=query,
             part="snippet",
-            maxResults=max_results,
+            fields=FIELDS["search_videos"],
+            maxResults=page_size,
             order=order,
             type="video",
             videoDuration=video_duration,
             videoType=video_type,
         )
-        response = request.execute()
 
-        videos = []
-        for item in response.get("items", []):
-            video_info = {
-                "videoId": item["id"]["videoId"],
-                "title": item["snippet"]["title"],
-                "description": item["snippet"]["description"],
-                "channelTitle": item["snippet"]["channelTitle"],
-                "publishedAt": item["snippet"]["publishedAt"],
-                "thumbnailUrl": item["snippet"]["thumbnails"]["default"]["url"],
-                "videoUrl": f"https://www.youtube.com/watch?v={item['id']['videoId']}",
-            }
-            videos.append(video_info)
-
-        return videos
+        # Closing this generator closes the pages too, cancelling any prefetched page.
+        async with contextlib.aclosing(pages):
+            async for response in pages:
+                for item in response.get("items", []):
+                    yield SearchResult(
+                        videoId=item["id"]["videoId"],
+                        title=item["snippet"]["title"],
+                        description=item["snippet"]["description"],
+                        channelTitle=item["snippet"]["channelTitle"],
+                        publishedAt=item["snippet"]["publishedAt"],
+                        thumbnailUrl=item["snippet"]["thumbnails"]["default"]["url"],
+                    )
 
     @tool
-    def get_video_details(self, video_ids):
+    @cached(ttl=5 * 60)
+    async def get_video_details(self, video_ids):
         """
         Gets detailed information for the specified video IDs.
         Args:
             video_ids (list): A list of video IDs.
         Returns:
-            dict: A dictionary mapping video IDs to their details.
+            dict: A dictionary mapping video IDs to their VideoDetails.
         """
-        request = self.youtube.videos().list(
-            part="snippet,contentDetails,statistics", id=",".join(video_ids)
-        )
-        response = request.execute()
+        if isinstance(video_ids, str):
+            video_ids = video_ids.split(",")
+
+        items = await self.loader("videos").load(video_ids)
 
         video_details = {}
-        for item in response.get("items", []):
-            video_id = item["id"]
-            video_details[video_id] = {
-                "title": item["snippet"]["title"],
-                "description": item["snippet"]["description"],
-                "viewCount": int(item["statistics"].get("viewCount", 0)),
-                "likeCount": int(item["statistics"].get("likeCount", 0)),
-                "commentCount": int(item["statistics"].get("commentCount", 0)),
-                "duration": item["contentDetails"]["duration"],
-                "thumbnailUrl": item["snippet"]["thumbnails"]["default"]["url"],
-                "videoUrl": f"https://www.youtube.com/watch?v={video_id}",
-            }
+        for video_id in video_ids:
+            if video_id not in items:
+                continue
+
+            item = items[video_id]
+            video_details[video_id] = VideoDetails(
+                id=video_id,
+                title=item["snippet"]["title"],
+                description=item["snippet"]["description"],
+                viewCount=int(item["statistics"].get("viewCount", 0)),
+                likeCount=int(item["statistics"].get("likeCount", 0)),
+                commentCount=int(item["statistics"].get("commentCount", 0)),
+                duration=item["contentDetails"]["duration"],
+                thumbnailUrl=item["snippet"]["thumbnails"]["default"]["url"],
+            )
 
         return video_details
 
     @tool
-    def get_channel_info(self, channel_id):
+    @cached(ttl=6 * 60 * 60)
+    async def get_channel_info(self, channel_id):
         """
         Gets information about a YouTube channel.
         Args:
-            channel_id (str): The ID of the YouTube channel.
+            channel_id (str): The ID of the YouTube channel, or its @handle.
         Returns:
-            dict: A dictionary containing channel information.
+            ChannelInfo: The channel information, or None if it was not found.
         """
-        request = self.youtube.channels().list(part="snippet,statistics", id=channel_id)
-        response = request.execute()
-
-        if "items" in response:
-            channel = response["items"][0]
-            return {
-                "title": channel["snippet"]["title"],
-                "description": channel["snippet"]["description"],
-                "subscriberCount": int(channel["statistics"]["subscriberCount"]),
-                "viewCount": int(channel["statistics"]["viewCount"]),
-                "videoCount": int(channel["statistics"]["videoCount"]),
-                "thumbnailUrl": channel["snippet"]["thumbnails"]["default"]["url"],
-                "channelUrl": f"https://www.youtube.com/channel/{channel_id}",
-            }
+        if channel_id.startswith("@"):
+            response = await self._execute(
+                self.youtube.channels().list(
+                    part=LOADER_PARTS["channels"], fields=FIELDS["channels"], forHandle=channel_id
+                )
+            )
+            items = {channel_id: item for item in response.get("items", [])[:1]}
+        else:
+            items = await self.loader("channels").load([channel_id])
+
+        if channel_id in items:
+            channel = items[channel_id]
+            return ChannelInfo(
+                id=channel["id"],
+                title=channel["snippet"]["title"],
+                description=channel["snippet"]["description"],
+                subscriberCount=int(channel["statistics"]["subscriberCount"]),
+                viewCount=int(channel["statistics"]["viewCount"]),
+                videoCount=int(channel["statistics"]["videoCount"]),
+                thumbnailUrl=channel["snippet"]["thumbnails"]["default"]["url"],
+            )
         return None
 
     @tool
-    def get_playlist_items(self, playlist_id, max_results=50):
+    @cached(ttl=30 * 60)
+    async def get_playlist_items(self, playlist_id, max_results=50):
         """
         Gets items from a specified playlist.
         Args:
             playlist_id (str): The ID of the playlist.
             max_results (int): Maximum number of results to return.
         Returns:
-            list: A list of dictionaries containing playlist item information.
+            list: A list of PlaylistItem records.
         """
-        request = self.youtube.playlistItems().list(
-            part="snippet", playlistId=playlist_id, maxResults=max_results
+        max_results = int(max_results)
+
+        return await take(
+            self.iter_playlist_items(
+                playlist_id,
+                page_size=min(max_results, 50),
+                prefetch=max_results > 50,
+                limit=max_results,
+            ),
+            max_results,
         )
-        response = request.execute()
 
-        playlist_items = []
-        for item in response.get("items", []):
-            playlist_items.append(
-                {
-                    "videoId": item["snippet"]["resourceId"]["videoId"],
-                    "title": item["snippet"]["title"],
-                    "description": item["snippet"]["description"],
-                    "publishedAt": item["snippet"]["publishedAt"],
-                    "thumbnailUrl": item["snippet"]["thumbnails"]["default"]["url"],
-                    "videoUrl": f"https://www.youtube.com/watch?v={item['snippet']['resourceId']['videoId']}",
-                }
-            )
-        return playlist_items
+    async def iter_playlist_items(self, playlist_id, page_size=50, prefetch=True, limit=None):
+        """
+        Lazily iterates over every item of a playlist, one result page at a time.
+        Args:
+            playlist_id (str): The ID of the playlist.
+            page_size (int): Items fetched per request, at most 50.
+            prefetch (bool): Fetch the next page while the current one is consumed.
+            limit (int): Stop requesting pages once this many items were received.
+        Yields:
+            PlaylistItem: Playlist item information, in the same shape as get_playlist_items.
+        """
+        pages = self._pages(
+            self.youtube.playlistItems().list,
+            prefetch,
+            limit,
+            part="snippet",
+            fields=FIELDS["playlistItems"],
+            playlistId=playlist_id,
+            maxResults=page_size,
+        )
+
+        async with contextlib.aclosing(pages):
+            async for response in pages:
+                for item in response.get("items", []):
+                    yield PlaylistItem(
+                        videoId=item["snippet"]["resourceId"]["videoId"],
+                        title=item["snippet"]["title"],
+                        description=item["snippet"]["description"],
+                        publishedAt=item["snippet"]["publishedAt"],
+                        thumbnailUrl=item["snippet"]["thumbnails"]["default"]["url"],
+                    )
 
     @tool
-    def get_comments(self, video_id, max_results=100):
+    @cached(ttl=5 * 60)
+    async def get_comments(self, video_id, max_results=100):
         """
         Gets comments for a specified video.
         Args:
             video_id (str): The ID of the video.
             max_results (int): Maximum number of comments to return.
         Returns:
-            list: A list of dictionaries containing comment information.
+            list: A list of Comment records.
         """
-        request = self.youtube.commentThreads().list(
-            part="snippet", videoId=video_id, maxResults=max_results
+        max_results = int(max_results)
+
+        return await take(
+            self.iter_comments(
+                video_id,
+                page_size=min(max_results, 100),
+                prefetch=max_results > 100,
+                limit=max_results,
+            ),
+            max_results,
         )
-        response = request.execute()
 
-        comments = []
-        for item in response.get("items", []):
-            comment = item["snippet"]["topLevelComment"]["snippet"]
-            comments.append(
-                {
-                    "author": comment["authorDisplayName"],
-                    "text": comment["textDisplay"],
-                    "likeCount": comment["likeCount"],
-                    "publishedAt": comment["publishedAt"],
-                }
-            )
-        return comments
+    async def iter_comments(self, video_id, page_size=100, prefetch=True, limit=None):
+        """
+        Lazily iterates over every top-level comment of a video, one result page at a time.
+        Args:
+            video_id (str): The ID of the video.
+            page_size (int): Comments fetched per request, at most 100.
+            prefetch (bool): Fetch the next page while the current one is consumed.
+            limit (int): Stop requesting pages once this many items were received.
+        Yields:
+            Comment: Comment information, in the same shape as get_comments.
+        """
+        pages = self._pages(
+            self.youtube.commentThreads().list,
+            prefetch,
+            limit,
+            part="snippet",
+            fields=FIELDS["commentThreads"],
+            videoId=video_id,
+            maxResults=page_size,
+        )
+
+        async with contextlib.aclosing(pages):
+            async for response in pages:
+                for item in response.get("items", []):
+                    comment = item["snippet"]["topLevelComment"]["snippet"]
+                    yield Comment(
+                        author=comment["authorDisplayName"],
+                        text=comment["textDisplay"],
+                        likeCount=comment["likeCount"],
+                        publishedAt=comment["publishedAt"],
+                    )
 
     @tool
-    def search_channels(self, query, max_results=5):
+    @cached(ttl=60 * 60)
+    async def search_channels(self, query, max_results=5):
         """
         Searches for YouTube channels based on a query.
         Args:
             query (str): The search query.
             max_results (int): Maximum number of results to return.
         Returns:
-            list: A list of dictionaries containing channel information.
+            list: A list of ChannelResult records.
         """
         request = self.youtube.search().list(
-            q=query, part="snippet", maxResults=max_results, type="channel"
+            q=query,
+            part="snippet",
+            fields=FIELDS["search_channels"],
+            maxResults=max_results,
+            type="channel",
         )
-        response = request.execute()
+        response = await self._execute(request)
 
         channels = []
         for item in response.get("items", []):
             channels.append(
-                {
-                    "channelId": item["id"]["channelId"],
-                    "title": item["snippet"]["title"],
-                    "description": item["snippet"]["description"],
-                    "thumbnailUrl": item["snippet"]["thumbnails"]["default"]["url"],
-                    "channelUrl": f"https://www.youtube.com/channel/{item['id']['channelId']}",
-                }
+                ChannelResult(
+                    channelId=item["id"]["channelId"],
+                    title=item["snippet"]["title"],
+                    description=item["snippet"]["description"],
+                    thumbnailUrl=item["snippet"]["thumbnails"]["default"]["url"],
+                )
             )
         return channels
 
     @tool
-    def get_video_categories(self, region_code="US"):
+    @cached(ttl=24 * 60 * 60)
+    async def get_video_categories(self, region_code="US"):
         """
         Gets a list of video category IDs for a specified country.
         Args:
             region_code (str): The region code for the country.
         Returns:
-            list: A list of dictionaries containing category information.
+            list: A list of Category records.
         """
         request = self.youtube.videoCategories().list(
-            part="snippet", regionCode=region_code
+            part="snippet", fields=FIELDS["videoCategories"], regionCode=region_code
         )
-        response = request.execute()
+        response = await self._execute(request)
 
         categories = []
         for item in response.get("items", []):
-            categories.append({"id": item["id"], "title": item["snippet"]["title"]})
+            categories.append(Category(id=item["id"], title=item["snippet"]["title"]))
         return categories
 
-    def get_function_map(self):
+    @classmethod
+    def get_function_map(cls):
         """
         Returns a dictionary mapping function names to their references.
         Returns:
@@ -225,11 +565,11 @@ class YouTubeDataAPI:
         """
         return {
             name: func
-            for name, func in vars(self.__class__).items()
+            for name, func in vars(cls).items()
             if isinstance(func, tuple)
         }
 
-    def call_method(self, function_call):
+    async def call_method(self, function_call):
         """
         Calls a method based on the provided function call structure.
         Args:
@@ -248,7 +588,10 @@ class YouTubeDataAPI:
         """
         function_name = function_call.get("function")
         params = function_call.get("params", {})
-        params["self"] = self
+
+        logger.debug("Calling %s with %s", function_name, params)
+
+        params = {**params, "self": self}
 
         if "q" in params.keys():
             params["query"] = params["q"]
@@ -260,9 +603,64 @@ class YouTubeDataAPI:
             raise ValueError(f"Function '{function_name}' not found")
 
         try:
-            print("function: ", function_name, " ", params)
-            print(function_map[function_name])
-            return function_map[function_name][0](**params)
+            return await function_map[function_name][0](**params)
 
         except Exception as e:
             raise ValueError(f"Error calling function '{function_name}': {str(e)}")
+
+
+JSON_TYPES = {
+    "str": {"type": "string"},
+    "int": {"type": "integer"},
+    "float": {"type": "number"},
+    "bool": {"type": "boolean"},
+    "list": {"type": "array", "items": {"type": "string"}},
+    "dict": {"type": "object"},
+}
+
+def tool_schema(func):
+    """
+    Builds the function calling schema of a tool from its signature and docstring.
+    Parameter types and descriptions come from the "name (type): description" lines of
+    the docstring's Args section, and parameters without a default are required.
+    Args:
+        func (Callable): The tool function.
+    Returns:
+        dict: A {"type": "function", "function": {...}} tool definition.
+    """
+    doc = inspect.getdoc(func) or ""
+    summary, _, rest = doc.partition("\n")
+    args = {
+        name: (kind, description.strip())
+        for name, kind, description in re.findall(
+            r"^\s*(\w+) \((\w+)\): (.+)$", rest.split("Returns:")[0], re.MULTILINE
+        )
+    }
+
+    properties = {}
+    required = []
+
+    for name, param in inspect.signature(func).parameters.items():
+        if name == "self":
+            continue
+
+        kind, description = args.get(name, ("str", ""))
+        properties[name] = {**JSON_TYPES.get(kind, {"type": "string"}), "description": description}
+
+        if param.default is inspect.Parameter.empty:
+            required.append(name)
+
+        else:
+            properties[name]["default"] = param.default
+
+    return {
+        "type": "function",
+        "function": {
+            "name": func.__name__,
+            "description": summary.strip(),
+            "parameters": {"type": "object", "properties": properties, "required": required},
+        },
+    }
+
+# Generated once, and sent with every agent request that uses native tool calling.
+TOOL_SCHEMAS = [tool_schema(func) for func, _ in YouTubeDataAPI.get_function_map().values()]
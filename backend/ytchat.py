@@ -1,108 +1,27 @@
 import os
 import json
-from typing import Any
-
-from yt import YouTubeDataAPI
-
-from contexts.GroqContext import WebGroqContext, WebGroqMessage
-
-from tinytune.prompt import prompt_job
-from tinytune.pipeline import Pipeline
-
-class YTChat:
-    def __init__(self, apiKey: str, ytKey: str):
-        self.LLM = WebGroqContext("llama-3.1-70b-versatile", apiKey)
-        self.YTAgent = WebGroqContext("llama-3.1-70b-versatile", apiKey)
-
-        self.YT = YouTubeDataAPI(ytKey)
-
-        self.Functions = self.YT.get_function_map()
-
-    def Prompt(self, inp: str):
-        response: str = ""
-
-        print("Input: ", inp)
-
-        def OnGenerate(x):
-            nonlocal response
-            response += x
-            return response
-
-        self.LLM.OnGenerate = lambda x: None
-
-        @prompt_job(id="Formatter", context=self.LLM)
-        def FormatJob(id: str, context: WebGroqContext, prevResult: Any):
-            nonlocal response
-            print("Formatting:", prevResult)
-            response = ""
-            self.LLM.OnGenerate = OnGenerate
-            return (
-                context.Prompt(WebGroqMessage("user", prevResult))
-                .Run(stream=True)
-                .Messages[-1]
-                .Content
-            )
-
-        @prompt_job(id="YTAgentPrompt", context=self.YTAgent)
-        def PromptJob(id: str, context: WebGroqContext, prevResult: Any):
-            return (
-                context.Prompt(WebGroqMessage("user", inp))
-                .Run(stream=True)
-                .Messages[-1]
-                .Content
-            )
-
-        @prompt_job(id="Execute", context=self.YTAgent)
-        def Execute(id: str, context: WebGroqContext, prevResult: Any):
-            prevResult = prevResult.strip()
-
-            print("Executing: ", prevResult)
-
-            try:
-                responses = {}
-
-                for result in prevResult.split("\n"):
-                    func: dict = json.loads(str(result))
-
-                    if not "function" in func:
-                        if "general" not in responses:
-                            responses["general"] = []
-
-                        responses["general"].append(json.dumps(func))
-
-                        continue
-
-                    resp = self.YT.call_method(func)
-
-                    print("Call Response:", resp)
-
-                    responses[func["function"]] = resp
-
-                context.Messages.append(
-                    WebGroqMessage("assistant", json.dumps(responses))
-                )
-
-            except Exception as e:
-                context.Messages.append(
-                    WebGroqMessage("assistant", json.dumps({"error": str(e)}))
-                )
-
-            return context.Messages[-1].Content
-
-        ChatPipeline = Pipeline(None)
-
-        ChatPipeline.AddJob(PromptJob).AddJob(Execute).AddJob(FormatJob)
-        ChatPipeline.Run(stream=True)
-
-        return ChatPipeline.Results["Formatter"][-1]
-
-    def Setup(self):
-        self.Functions = self.YT.get_function_map()
-
-        self.LLM.Prompt(
-            WebGroqMessage(
-                "user",
-                """
+import asyncio
+import logging
+import functools
+from typing import Any, Callable
+
+from yt import YouTubeDataAPI, TOOL_SCHEMAS
+from executor import ToolCallBatch
+from formatter import format_responses, summarize
+from records import dumps
+from compact import encode
+from plan_cache import PlanCache
+from intents import route_intent
+from metrics import span, STAGE_SECONDS, PLANS
+
+from contexts.GroqContext import WebGroqMessage
+from contexts.async_context import AsyncChatContext
+from contexts.router_context import CreateContext
+from contexts.token_stream import TokenStream
+
+logger = logging.getLogger(__name__)
+
+FORMATTER_PROMPT = """
             You are a JSON formatter for YouTube API responses. You take in structured YouTube data and format it according to the following schema:
             {
                 "response": {
@@ -160,18 +79,35 @@ class YTChat:
             Your task is to take the structured YouTube API responses and format them according to this schema. 
             Populate the relevant fields based on the data provided. Use the 'misc' object for any additional information that doesn't fit into the predefined categories. 
             Ensure all data is properly formatted and typed according to the schema.
-        """,
-            )
-        )
+        """
 
-        self.YTAgent.Prompt(
-            WebGroqMessage(
-                "user",
-                f"""
+
+# The YTAgent calls tools through the provider's function calling API. With
+# AGENT_NATIVE_TOOLS=0 it writes the calls out as JSON lines instead.
+AGENT_NATIVE_TOOLS = os.getenv("AGENT_NATIVE_TOOLS", "1") == "1"
+
+NATIVE_AGENT_PROMPT = """
+                    You are an AI assistant designed to interact with YouTube. Use the provided functions to fetch YouTube data, calling several at once when the question needs more than one.
+                    If no function fits, answer using your current knowledge about YouTube in one paragraph at most, without mentioning functions.
+                    """
+
+
+@functools.cache
+def AgentPrompt(native: bool = False) -> str:
+    """
+    Builds the YTAgent system prompt once per process, since the tool docs it embeds never change.
+    With native tool calling the tools are described by their schemas instead.
+    """
+    if native:
+        return NATIVE_AGENT_PROMPT
+
+    functions = YouTubeDataAPI.get_function_map()
+
+    return f"""
                     You are an AI assistant designed to interact with YouTube. You have access to the following YouTube-related functions:
 
                     Use the following functions:
-                    {json.dumps({key: {"name": key, "doc": self.Functions[key][0].__doc__} for key in self.Functions})}
+                    {json.dumps({key: {"name": key, "doc": functions[key][0].__doc__} for key in functions})}
 
                     If you choose to call a function to interact with YouTube, ONLY reply in the following format with no prefix or suffix:
                     {{"function": "function_name", "params": {{"param": "value"}}}}
@@ -203,6 +139,263 @@ class YTChat:
                     - ABSOLUTELY NO backticks (`) or any other code formatting should be used in your responses
                     - DO NOT include any explanatory text or comments outside of the JSON structure
                     - ONLY plain, unformatted JSON should be returned, with no additional text or formatting of any kind
-                    """,
+                    """
+
+
+@functools.cache
+def SharedPlanCache() -> PlanCache | None:
+    """
+    Returns the process-wide YTAgent plan cache, or None when PLAN_CACHE_SIZE is 0.
+    """
+    size = int(os.getenv("PLAN_CACHE_SIZE", 1024))
+
+    if size <= 0:
+        return None
+
+    return PlanCache(
+        max_entries=size,
+        ttl=float(os.getenv("PLAN_CACHE_TTL", 600)),
+        similarity=float(os.getenv("PLAN_CACHE_SIMILARITY", 0.85)),
+    )
+
+
+# Inputs that only name videos, channels or playlists are planned without the agent.
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "1") == "1"
+
+
+REMARKS_PROMPT = """
+            You write the remarks for a YouTube assistant's responses. You receive the user's question and the structured YouTube data that was fetched for it, as JSON.
+            Reply with a plain-text explanation of the data that answers the question. Consider the entire response, and mention all the info. If the data contains details and metrics, make sure to mention them all.
+            Add formatting where necessary, but never reply with JSON, code blocks or backticks.
+        """
+
+
+class YTChat:
+    # "remarks": tool results are formatted in Python and the LLM only writes the remarks.
+    # "structured": no LLM call at all, remarks are built from the data.
+    # "llm": the LLM formats the whole response from the raw tool results.
+    FormatModes = ("remarks", "structured", "llm")
+
+    def __init__(self, apiKey: str, ytKey: str, formatMode: str | None = None):
+        self.FormatMode = formatMode or os.getenv("FORMAT_MODE", "remarks")
+
+        if self.FormatMode not in YTChat.FormatModes:
+            raise ValueError(f"Unknown format mode '{self.FormatMode}'")
+
+        self.LLM = CreateContext(apiKey)
+        self.YTAgent = CreateContext(apiKey)
+
+        if AGENT_NATIVE_TOOLS:
+            self.YTAgent.Tools = TOOL_SCHEMAS
+
+        self.YT = YouTubeDataAPI(ytKey)
+
+        self.Functions = self.YT.get_function_map()
+
+        # The session journal version this chat's history corresponds to.
+        self.Version = 0
+
+    def CountTokens(self) -> int:
+        return self.LLM.CountTokens() + self.YTAgent.CountTokens()
+
+    def TrimHistory(self, maxTokens: int) -> int:
+        return self.LLM.TrimHistory(maxTokens // 2) + self.YTAgent.TrimHistory(
+            maxTokens // 2
+        )
+
+    def Contexts(self) -> dict[str, AsyncChatContext]:
+        return {"LLM": self.LLM, "YTAgent": self.YTAgent}
+
+    async def Prompt(self, inp: str, onEvent: Callable[[dict], Any] | None = None):
+        logger.debug("Input: %s", inp)
+
+        if onEvent is None:
+            onEvent = lambda event: None
+
+        # The formatter's output, streamed to the client as deltas while it is generated.
+        response = TokenStream()
+        delta = {"event": "delta", "stage": "Formatter"}
+
+        response.Subscribe(lambda x: onEvent({**delta, "content": x}))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            response.Subscribe(lambda x: logger.debug("Formatter delta: %r", x))
+
+        self.LLM.OnGenerate = lambda x: None
+
+        # What Execute produced, handed to the formatter as is rather than re-parsed.
+        executed: Any = None
+
+        async def FormatJob(id: str, context: AsyncChatContext, prevResult: Any):
+            logger.debug("Formatting: %s", prevResult)
+            response.Clear()
+
+            if self.FormatMode == "llm":
+                self.LLM.OnGenerate = response.Write
+                # The whole schema is filled in by the LLM, so it gets the full results.
+                return (
+                    await context.Prompt(
+                        WebGroqMessage("user", dumps(executed), "tool_result")
+                    ).RunAsync(stream=True)
+                ).Messages[-1].Content
+
+            formatted = format_responses(executed)
+
+            onEvent({"event": "data", "response": formatted["response"]})
+
+            if self.FormatMode == "structured" or not formatted["response"]["data"]:
+                formatted["remarks"] = summarize(formatted)
+
+                delta["field"] = "remarks"
+                response.Write(formatted["remarks"])
+
+                return dumps(formatted)
+
+            delta["field"] = "remarks"
+
+            # General messages from the agent are kept verbatim, ahead of the LLM's remarks.
+            if formatted["remarks"]:
+                response.Write(formatted["remarks"] + "\n\n")
+
+            self.LLM.OnGenerate = response.Write
+
+            await context.Prompt(
+                WebGroqMessage(
+                    "user",
+                    encode({"question": inp, "data": formatted["response"]["data"]}, id),
+                    "tool_result",
+                )
+            ).RunAsync(stream=True)
+
+            formatted["remarks"] = response.Text()
+
+            return dumps(formatted)
+
+        # Tool calls are started from the agent's stream as soon as each line is complete.
+        batch = ToolCallBatch(self.YT)
+
+        async def PromptJob(id: str, context: AsyncChatContext, prevResult: Any):
+            plans = SharedPlanCache()
+            source = "intent"
+            plan = route_intent(inp) if INTENT_ROUTER else None
+
+            if plan is None and plans is not None:
+                source = "cache"
+                plan = plans.get(inp)
+
+            if plan is not None:
+                # Replay the plan as if the agent had just produced it.
+                PLANS.labels(source=source).inc()
+                context.Messages.append(WebGroqMessage("user", inp))
+                context.Messages.append(WebGroqMessage("assistant", plan))
+                batch.feed(plan)
+
+                return plan
+
+            PLANS.labels(source="agent").inc()
+
+            context.OnGenerate = batch.feed
+
+            try:
+                plan = (
+                    await context.Prompt(WebGroqMessage("user", inp)).RunAsync(stream=True)
+                ).Messages[-1].Content
+
+            finally:
+                context.OnGenerate = lambda x: None
+
+            if plans is not None:
+                plans.put(inp, plan)
+
+            return plan
+
+        async def Execute(id: str, context: AsyncChatContext, prevResult: Any):
+            nonlocal executed
+
+            logger.debug("Executing: %s", prevResult.strip())
+
+            try:
+                batch.finish()
+
+                executed = await batch.results()
+
+                context.Messages.append(
+                    WebGroqMessage("assistant", encode(executed, id), "tool_result")
+                )
+
+            except Exception as e:
+                batch.cancel()
+
+                executed = {"error": str(e)}
+
+                context.Messages.append(
+                    WebGroqMessage("assistant", dumps(executed))
+                )
+
+            return context.Messages[-1].Content
+
+        jobs = [
+            ("YTAgentPrompt", self.YTAgent, PromptJob),
+            ("Execute", self.YTAgent, Execute),
+            ("Formatter", self.LLM, FormatJob),
+        ]
+
+        prevResult: Any = None
+
+        try:
+            for id, context, job in jobs:
+                onEvent({"event": "stage", "stage": id})
+
+                with span(STAGE_SECONDS, stage=id):
+                    prevResult = await job(id, context, prevResult)
+
+        except BaseException:
+            batch.cancel()
+            raise
+
+        return prevResult
+
+    async def PromptStream(self, inp: str):
+        """
+        Runs Prompt and yields its stage and delta events as they happen, followed by
+        a final {"event": "done", "response": ...} event holding the formatter output.
+        Exceptions raised by the pipeline propagate after the already queued events.
+        """
+        events: asyncio.Queue = asyncio.Queue()
+
+        task = asyncio.create_task(self.Prompt(inp, onEvent=events.put_nowait))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+
+            yield {"event": "done", "response": task.result()}
+
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def Setup(self):
+        self.Functions = self.YT.get_function_map()
+
+        self.LLM.Prompt(
+            WebGroqMessage(
+                "system", FORMATTER_PROMPT if self.FormatMode == "llm" else REMARKS_PROMPT
             )
         )
+        self.YTAgent.Prompt(WebGroqMessage("system", AgentPrompt(AGENT_NATIVE_TOOLS)))
+
+    def Restore(self, messages: dict[str, list[dict]]):
+        """
+        Sets the chat up and appends the journaled messages of each context after its
+        system prompts.
+        """
+        self.Setup()
+
+        for name, context in self.Contexts().items():
+            context.Messages.extend(
+                WebGroqMessage(message["role"], message["content"], message["type"])
+                for message in messages.get(name, [])
+            )
+            context.PersistedCount = len(context.Messages)
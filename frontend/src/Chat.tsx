@@ -3,6 +3,7 @@ import { Textarea } from './components/ui/textarea';
 import { Button } from '@/components/ui/button';
 import YTEmbed from './components/YTEmbed';
 import { useWebSpeechAPI } from './hooks/useWebSpeechAPI';
+import { PartialRemarks, PromptEvent, StageLabel, StreamPrompt } from './services/Prompt';
 
 interface Message {
     Role: string;
@@ -18,6 +19,17 @@ function Message({ Role, Content }: Message) {
     </div >
 }
 
+function RenderResponse(response: any, remarks: React.ReactNode) {
+    return <div className="flex flex-col gap-5">
+        <div>{remarks}</div>
+        {response?.data?.videos && response.data.videos.length > 0 && (
+            <div className="flex flex-col gap-3">
+                {response.data.videos.map((video: any) => <YTEmbed key={video.id} videoId={video.id} />)}
+            </div>
+        )}
+    </div>;
+}
+
 function Chat() {
     const messagesRef = useRef<Message[]>([
         {
@@ -61,38 +73,68 @@ function Chat() {
             promptInput.current.value = "";
         }
 
-        console.log(body);
-        try {
-            const response = await fetch("http://localhost:8000/prompt", {
-                method: "POST",
-                headers: {
-                    "Content-Type": "application/json"
-                },
-                body: JSON.stringify(body)
-            });
-
-            if (response.ok) {
-                const data = await response.json();
+        const SetAssistantContent = (content: React.ReactNode) => {
+            messagesRef.current[messagesRef.current.length - 1] = {
+                Role: "assistant",
+                Content: content
+            };
+            setMessages([...messagesRef.current]);
+        };
 
-                console.log(data);
+        let streamed = "";
+        let data: any = null;
+        let finished = false;
 
-                if (chatId.current == null) {
-                    chatId.current = data.chat_id;
+        console.log(body);
+        try {
+            await StreamPrompt(body, (event: PromptEvent) => {
+                switch (event.event) {
+                    case "chat":
+                        if (chatId.current == null) {
+                            chatId.current = event.chat_id ?? null;
+                        }
+                        break;
+
+                    case "stage":
+                        streamed = "";
+                        SetAssistantContent(<div className="flex flex-col gap-5">
+                            <div>{StageLabel(event.stage ?? "")}</div>
+                        </div>);
+                        break;
+
+                    case "data":
+                        data = event.response;
+                        SetAssistantContent(RenderResponse(data, StageLabel("Formatter")));
+                        break;
+
+                    case "delta":
+                        streamed += event.content ?? "";
+
+                        if (event.field == "remarks") {
+                            SetAssistantContent(RenderResponse(data, streamed));
+                            break;
+                        }
+
+                        SetAssistantContent(<div className="flex flex-col gap-5">
+                            <div>{PartialRemarks(streamed) ?? StageLabel(event.stage ?? "")}</div>
+                        </div>);
+                        break;
+
+                    case "done":
+                        console.log(event.response);
+
+                        SetAssistantContent(RenderResponse(event.response.response, event.response.remarks));
+                        setPromptState("success");
+                        finished = true;
+                        break;
+
+                    case "error":
+                        throw new Error(event.message);
                 }
+            });
 
-                messagesRef.current[messagesRef.current.length - 1] = {
-                    Role: "assistant",
-                    Content: <div className="flex flex-col gap-5">
-                        <div>{data.response.remarks}</div>
-                        {data.response.response.data.videos && data.response.response.data.videos.length > 0 && (
-                            <div className="flex flex-col gap-3">
-                                {data.response.response.data.videos.map((video: any) => <YTEmbed key={video.id} videoId={video.id} />)}
-                            </div>
-                        )}
-                    </div>
-                };
-                setMessages([...messagesRef.current]);
-                setPromptState("success");
+            if (!finished) {
+                throw new Error("Response stream ended before the response was complete.");
             }
         }
         catch (e) {
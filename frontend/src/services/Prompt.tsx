@@ -0,0 +1,83 @@
+export interface PromptEvent {
+    event: "chat" | "stage" | "data" | "delta" | "done" | "error";
+    chat_id?: string;
+    stage?: string;
+    field?: string;
+    content?: string;
+    response?: any;
+    message?: string;
+}
+
+/**
+ * Posts a prompt to the streaming endpoint and calls onEvent for every Server-Sent Event
+ * as soon as it arrives.
+ */
+export async function StreamPrompt(body: object, onEvent: (event: PromptEvent) => void) {
+    const response = await fetch("http://localhost:8000/prompt/stream", {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json"
+        },
+        body: JSON.stringify(body)
+    });
+
+    if (!response.ok || response.body == null) {
+        throw new Error(`Prompt failed with status ${response.status}`);
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+
+        if (done) {
+            break;
+        }
+
+        buffer += value;
+
+        let boundary = buffer.indexOf("\n\n");
+
+        while (boundary >= 0) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            for (const line of frame.split("\n")) {
+                if (line.startsWith("data: ")) {
+                    onEvent(JSON.parse(line.slice(6)));
+                }
+            }
+
+            boundary = buffer.indexOf("\n\n");
+        }
+    }
+}
+
+const stageLabels: Record<string, string> = {
+    YTAgentPrompt: "Thinking...",
+    Execute: "Fetching from YouTube...",
+    Formatter: "Writing response..."
+};
+
+export function StageLabel(stage: string) {
+    return stageLabels[stage] ?? "Loading...";
+}
+
+/**
+ * Pulls the (possibly unterminated) "remarks" string out of partially streamed formatter JSON.
+ */
+export function PartialRemarks(text: string) {
+    const match = text.match(/"remarks"\s*:\s*"((?:[^"\\]|\\.)*)/);
+
+    if (match == null) {
+        return null;
+    }
+
+    try {
+        return JSON.parse(`"${match[1].replace(/\\$/, "")}"`) as string;
+    }
+    catch {
+        return match[1];
+    }
+}